@@ -1,40 +1,75 @@
 from __future__ import annotations
 
 # standard library
+import asyncio
 from contextlib import asynccontextmanager
 
 # fastapi
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
-from fastapi.staticfiles import StaticFiles
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.middleware import Middleware
-from starlette.middleware.sessions import SessionMiddleware
 
 # local
 from SSD_Roster import __version__
-from SSD_Roster.routes import login, logout, logs, register, root, roster, timetable, user, verify
-from SSD_Roster.src.database import database
+from SSD_Roster.routes import login, logout, logs, metrics, profiler, register, root, roster, timetable, user, verify
+from SSD_Roster.src.compression import CompressionMiddleware
+from SSD_Roster.src.database import database, QueryLogMiddleware
 from SSD_Roster.src.database import setup as db_setup
+from SSD_Roster.src.email import email_outbox, email_renderer
 from SSD_Roster.src.environment import settings
 from SSD_Roster.src.exception_handlers import exception_handler, validation_exception_handler
+from SSD_Roster.src.log_archive import LogArchive
+from SSD_Roster.src.loop_monitor import loop_monitor
+from SSD_Roster.src.metrics import MetricsMiddleware
 from SSD_Roster.src.models import GroupedScope
 from SSD_Roster.src.monkey_patch import patch_passlib
+from SSD_Roster.src.notifications import roster_notifier
+from SSD_Roster.src.request_context import RequestIDMiddleware
+from SSD_Roster.src.roster import roster_broadcaster
+from SSD_Roster.src.sessions import MemorySessionBackend, ServerSessionMiddleware, SQLiteSessionBackend
+from SSD_Roster.src.static import static_files
+from SSD_Roster.src.templates import precompile
+from SSD_Roster.src.verification import verification_code_purge
 
 
-logs.inject()  # manipulates sys.stdout and sys.stderr to get logged (redirects to behave normally)
+# manipulates sys.stdout and sys.stderr to get logged (redirects to behave normally)
+logs.inject(settings.LOG.LIMIT, settings.LOG.QUEUE_SIZE, settings.LOG.OVERFLOW, settings.LOG.SHARED)
 patch_passlib()
 
 
 @asynccontextmanager
 async def lifespan(_):  # noqa ANN001
     try:
+        if settings.LOOP_MONITOR.ENABLED:
+            loop_monitor.start()  # first, so blocking calls of the startup are caught as well
+        if settings.LOG.ARCHIVE:  # not on import, so importing the app doesn't create the file
+            logs.attach_archive(
+                await asyncio.to_thread(
+                    LogArchive,
+                    settings.LOG.ARCHIVE,
+                    settings.LOG.ARCHIVE_MAX_MB * 1024 * 1024,
+                    settings.LOG.ARCHIVE_MAX_DAYS,
+                )
+            )
         await database.connect()
         await db_setup()
         await GroupedScope.sync_with_db()
+        await asyncio.to_thread(static_files.build)  # compresses (once per content) and fingerprints the static files
+        await asyncio.to_thread(precompile)  # so the first requests after a (re)start don't compile them
+        roster_broadcaster.start()
+        verification_code_purge.start()
+        if not settings.MAIL.DISABLED:  # otherwise the emails are kept until it's enabled
+            email_outbox.start()
         yield
     finally:
+        await roster_notifier.stop()  # may still queue emails
+        await email_outbox.stop()
+        await roster_broadcaster.stop()
+        await verification_code_purge.stop()
         await database.disconnect()
+        await loop_monitor.stop()
+        await asyncio.to_thread(logs.attach_archive, None)  # writes what's still queued
 
 
 app = FastAPI(
@@ -43,11 +78,39 @@ app = FastAPI(
     version=__version__,
     docs_url=None,
     redoc_url=None,
-    middleware=[Middleware(SessionMiddleware, secret_key=settings.SECRET_KEY.get_secret_value())],
+    middleware=[
+        Middleware(RequestIDMiddleware),
+        *([Middleware(MetricsMiddleware)] if settings.METRICS.ENABLED else []),
+        *(
+            [
+                Middleware(
+                    QueryLogMiddleware,
+                    threshold=settings.DATABASE.REPEATED_QUERY_THRESHOLD,
+                    server_timing=DEBUG,
+                )
+            ]
+            if settings.DATABASE.QUERY_LOG
+            else []
+        ),
+        *(
+            [Middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION.MINIMUM_SIZE)]
+            if settings.COMPRESSION.ENABLED
+            else []
+        ),
+        Middleware(
+            ServerSessionMiddleware,
+            backend=(
+                SQLiteSessionBackend(settings.SESSION.SQLITE)
+                if settings.SESSION.BACKEND == "sqlite"
+                else MemorySessionBackend(settings.SESSION.MEMORY_SIZE)
+            ),
+            max_age=settings.SESSION.MAX_AGE * 60 * 60,
+        ),
+    ],
     lifespan=lifespan,
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", static_files, name="static")
 root.setup(app)
 
 
@@ -57,6 +120,9 @@ app.add_exception_handler(RequestValidationError, validation_exception_handler)
 app.include_router(login.router)
 app.include_router(logout.router)
 app.include_router(logs.router)
+if settings.METRICS.ENABLED:
+    app.include_router(metrics.router)
+app.include_router(profiler.router)
 app.include_router(register.router)
 app.include_router(root.router)
 app.include_router(roster.router)
@@ -64,6 +130,8 @@ app.include_router(timetable.router)
 app.include_router(user.router)
 app.include_router(verify.router)
 
+email_renderer.bind(app.router)  # for the links in emails
+
 
 if __name__ == "__main__":
     import uvicorn  # isort: skip
@@ -11,15 +11,16 @@ from pydantic import SecretStr
 from typing import Annotated, Literal
 
 # fastapi
-from fastapi import APIRouter, Form, Request
+from fastapi import APIRouter, Depends, Form, Request
 from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 
 # local
 from SSD_Roster.routes.user import get_messages_api
-from SSD_Roster.src.database import database
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
 from SSD_Roster.src.messages import flash
-from SSD_Roster.src.models import LoginResponseSchema, MessageCategory, ResponseSchema, UserModel, UserSchema
+from SSD_Roster.src.models import LoginResponseSchema, MessageCategory, ResponseSchema, UserSchema
 from SSD_Roster.src.oauth2 import authenticate_user, create_access_token
+from SSD_Roster.src.sessions import load_session
 from SSD_Roster.src.templates import templates
 
 
@@ -33,6 +34,7 @@ router = APIRouter(
     "/",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def login(request: Request):
     return templates.TemplateResponse(request, "login.html")
@@ -42,14 +44,16 @@ async def login(request: Request):
     "/",
     include_in_schema=False,
     response_class=RedirectResponse,
+    dependencies=[Depends(load_session)],
 )
 async def manage_login(
     request: Request,
     response: Response,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     username: Annotated[str, Form()] = "",
     password: Annotated[SecretStr, Form()] = "",
 ):
-    data: LoginResponseSchema | ResponseSchema = await manage_login_api(response, username, password)
+    data: LoginResponseSchema | ResponseSchema = await manage_login_api(response, users, username, password)
 
     if not isinstance(data, LoginResponseSchema):  # unsuccessful
         flash(request, data.message, MessageCategory.ERROR)
@@ -59,7 +63,7 @@ async def manage_login(
     flash(request, data.message, MessageCategory.SUCCESS)
 
     for message in (await get_messages_api(request, response, data.user)).messages:
-        flash(request, message.content, message.category)
+        flash(request, message.message, message.category)
 
     response.set_cookie(
         "token",
@@ -82,16 +86,17 @@ async def manage_login(
 )
 async def manage_login_api(
     response: Response,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     username: Annotated[str, Form()] = "",
     password: Annotated[SecretStr, Form()] = "",
 ) -> LoginResponseSchema | ResponseSchema:
-    user: UserSchema | Literal[False] = await authenticate_user(username, password)
+    user: UserSchema | Literal[False] = await authenticate_user(username, password, users)
 
     # can't log in
     if user is False:
         response.status_code = 401
         # add a bit of context for freshly registered users
-        if (_user := await database.fetch_one(UserModel.select().where(UserModel.username == username))) is not None:
+        if (_user := await users.get_by("username", username)) is not None:
             _message_fractals: list[str] = []
             if _user.email_verified is False:
                 _message_fractals.append("without your email being verified")
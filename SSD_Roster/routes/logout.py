@@ -7,15 +7,19 @@ from textwrap import dedent
 import jwt
 from jwt import PyJWTError
 
+# typing
+from typing import Annotated
+
 # fastapi
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse, Response
 
 # local
-from SSD_Roster.src.database import database
 from SSD_Roster.src.environment import settings
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
 from SSD_Roster.src.messages import flash
 from SSD_Roster.src.models import MessageCategory, UserModel
+from SSD_Roster.src.sessions import load_session
 
 
 router = APIRouter(
@@ -34,10 +38,12 @@ router = APIRouter(
     """
     ),
     response_class=RedirectResponse,
+    dependencies=[Depends(load_session)],
 )
 async def logout(
     request: Request,
     response: Response,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
 ):
     if (token := request.cookies.get("token")) is not None:
         response.delete_cookie("token")  # this is the logout process, nothing more, nothing less
@@ -48,7 +54,7 @@ async def logout(
                 [settings.TOKEN.ALGORITHM],
                 options={"verify_exp": False},
             ).get("sub")
-            db_user = await database.fetch_one(UserModel.select().where(UserModel.user_id == int(user_id)))
+            db_user = await users.get(int(user_id))
             if db_user is None:
                 raise ValueError
         except (PyJWTError, ValueError):
@@ -1,60 +1,217 @@
 from __future__ import annotations
 
 # standard library
+import asyncio
+import atexit
 import sys
+from datetime import datetime, timezone
 from io import TextIOWrapper
 
+# third party
+import orjson
+
 # typing
-from typing import Annotated, AnyStr
+from typing import Annotated, AnyStr, AsyncIterator, Literal, Optional
 
 # fastapi
-from fastapi import APIRouter, Request, Security
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, Header, Query, Request, Security
+from fastapi.responses import HTMLResponse, StreamingResponse
 
 # local
-from SSD_Roster.src.models import Scope, UserSchema
+from SSD_Roster.src.log_archive import LogArchive
+from SSD_Roster.src.log_store import BackgroundWriter, Level, LEVELS, LogBuffer, LogGrouper, LogRecord, Overflow
+from SSD_Roster.src.models import PageID, Scope, UserSchema
 from SSD_Roster.src.oauth2 import get_current_user
+from SSD_Roster.src.request_context import request_id
+from SSD_Roster.src.sessions import load_session
+from SSD_Roster.src.shared_log import SharedLogBuffer
 from SSD_Roster.src.templates import templates
 
 
 router = APIRouter(prefix="/logs")
 
 
-_logs = []
+_logs = LogBuffer(1000)
+_writers: list[BackgroundWriter] = []
+_archive: Optional[LogArchive] = None
 _injected: bool = False
 
+STREAM_QUEUE_SIZE = 1000  # per subscriber, older records are dropped for slow subscribers
+STREAM_KEEP_ALIVE = 15  # seconds
+
+
+def _append(source: Literal["stdout", "stderr"], level: Level, message: str, request_id_: Optional[str]) -> None:
+    record = _logs.append(source, level, message, request_id_)
+    if _archive is not None:
+        _archive.add(record)
+
+
+def _close() -> None:
+    # the writers first, as they still pass records to the archive
+    for writer in _writers:
+        writer.close()
+    if _archive is not None:
+        _archive.close()
+
 
 # inject own stdin and stdout
-def inject(log_limit: int = 1000):
-    global _injected
+def inject(
+    log_limit: int = 1000,
+    queue_size: int = 10_000,
+    overflow: Overflow = "drop-oldest",
+    shared: Optional[str] = None,
+):
+    global _injected, _logs
     if _injected:
         return
+    # with several workers every one of them has to write to (and read from) the same buffer
+    _logs = SharedLogBuffer(shared, log_limit) if shared else LogBuffer(log_limit)
 
     def redirect(to: TextIOWrapper):
-        _write = to.write
+        writer = BackgroundWriter(to.write, to.flush, LogGrouper(to.name[1:-1], _append), queue_size, overflow)
+        _writers.append(writer)
 
         def write(s: AnyStr) -> int:
-            _logs.append({"source": to.name[1:-1], "message": s})
-            if len(_logs) > log_limit:
-                _logs.pop(0)
-            return _write(s)
+            # the actual writing (and storing) is done by the writer's thread
+            writer.put(s, request_id.get())
+            return len(s)
 
         to.write = write
         return to
 
     sys.stdout = redirect(sys.__stdout__)
     sys.stderr = redirect(sys.__stderr__)
+    atexit.register(_close)
     _injected = True
 
 
+def attach_archive(archive: Optional[LogArchive]) -> None:
+    """Records are archived from now on; ``None`` detaches (and closes, blocking) the current archive"""
+    global _archive
+    previous, _archive = _archive, archive
+    if previous is not None:
+        previous.close()
+
+
 @router.get(
     "/",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def logs(
     request: Request,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_LOGS])],
+    source: Optional[Literal["stdout", "stderr", ""]] = None,  # "" as the filter-form submits empty selections
+    level: Optional[Level | Literal[""]] = None,
+    search: Annotated[Optional[str], Query(max_length=200)] = None,
+    request_id_: Annotated[Optional[str], Query(alias="request_id", max_length=32)] = None,
+    archive: bool = False,
+    start: Optional[datetime | Literal[""]] = None,  # only for the archive
+    end: Optional[datetime | Literal[""]] = None,  # only for the archive
+    page: PageID = 0,
+    per_page: Annotated[int, Query(ge=1, le=500)] = 100,
+):
+    source, level, search, request_id_ = source or None, level or None, search or None, request_id_ or None
+    # times without timezone (as sent by the form) are in UTC, just as they are displayed
+    start, end = ((t.replace(tzinfo=t.tzinfo or timezone.utc) if t else None) for t in (start, end))
+    archive = archive and _archive is not None
+
+    if archive:
+        records, total = await asyncio.to_thread(
+            _archive.search,
+            start=start,
+            end=end,
+            source=source,
+            level=level,
+            text=search,
+            request_id=request_id_,
+            offset=page * per_page,
+            limit=per_page,
+        )
+    else:
+        records, total = _logs.query(
+            source=source,
+            level=level,
+            text=search,
+            request_id=request_id_,
+            offset=page * per_page,
+            limit=per_page,
+        )
+
+    # navigation (keeps the filters)
+    def page_url(to: int) -> str:
+        url = request.url.include_query_params(page=to)
+        return f"{url.path}?{url.query}"
+
+    return templates.TemplateResponse(
+        request,
+        "logs.html",
+        {
+            "logs": records,
+            "total": total,
+            "capacity": _logs.capacity,
+            "dropped": sum(writer.dropped for writer in _writers),
+            "injected": _injected,
+            "archive_available": _archive is not None,
+            "archive": archive,
+            "levels": LEVELS,
+            "filters": {
+                "source": source,
+                "level": level,
+                "search": search,
+                "request_id": request_id_,
+                "start": start.strftime("%Y-%m-%dT%H:%M") if start else "",
+                "end": end.strftime("%Y-%m-%dT%H:%M") if end else "",
+            },
+            "per_page": per_page,
+            "newer": page_url(page - 1) if page > 0 else None,
+            "older": page_url(page + 1) if (page + 1) * per_page < total else None,
+        },
+    )
+
+
+def _to_event(record: LogRecord) -> bytes:
+    return b"id: %d\nevent: log\ndata: %b\n\n" % (record.seq, orjson.dumps(record._asdict()))
+
+
+@router.get(
+    "/stream",
+    include_in_schema=False,
+    response_class=StreamingResponse,
+)
+async def logs_stream(
+    request: Request,
+    user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_LOGS])],
+    last_event_id: Annotated[Optional[int], Header()] = None,
 ):
-    # ToDo: make logs able to use "\n" (especially needed for tracebacks as they aren't pretty without linebreaks)
-    return templates.TemplateResponse(request, "logs.html", {"logs": _logs, "injected": _injected})
+    async def events() -> AsyncIterator[bytes]:
+        buffer = _logs
+        subscription = buffer.subscribe(STREAM_QUEUE_SIZE)
+        try:
+            yield b"retry: 3000\n\n"
+            last_sent = -1 if last_event_id is None else last_event_id
+            if last_event_id is not None:  # reconnected; send what was missed (if it's still buffered)
+                for record in buffer.since(last_event_id):
+                    yield _to_event(record)
+                    last_sent = record.seq
+            dropped = 0
+            while not await request.is_disconnected():
+                records = await subscription.get(timeout=STREAM_KEEP_ALIVE)
+                if subscription.dropped != dropped:
+                    yield b"event: dropped\ndata: %d\n\n" % (subscription.dropped - dropped)
+                    dropped = subscription.dropped
+                if not records:
+                    yield b": keep-alive\n\n"
+                for record in records:
+                    if record.seq > last_sent:  # may already be sent as part of the missed records
+                        yield _to_event(record)
+                        last_sent = record.seq
+        finally:
+            buffer.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+# typing
+from typing import Annotated, Optional
+
+# fastapi
+from fastapi import APIRouter, Cookie, Depends, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.security import SecurityScopes
+
+# local
+from SSD_Roster.src.environment import settings
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
+from SSD_Roster.src.metrics import registry
+from SSD_Roster.src.models import Scope
+from SSD_Roster.src.oauth2 import get_current_user, optional_oauth2_scheme
+
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+
+@router.get(
+    "",
+    summary="Metrics in the Prometheus text-format",
+    description=(
+        "Request counts and latencies per route, database queries and cache hits (of the worker answering). "
+        f"Hosts of `METRICS__ALLOWED_HOSTS` may scrape it without a token, everyone else needs `{Scope.SEE_METRICS}`."
+    ),
+    response_class=PlainTextResponse,
+)
+async def metrics(
+    request: Request,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
+    bearer: Annotated[Optional[str], Depends(optional_oauth2_scheme)],  # as sent by scrapers
+    token: Annotated[str, Cookie()] = "PUBLIC",
+):
+    if request.client is None or request.client.host not in settings.METRICS.ALLOWED_HOSTS:
+        await get_current_user(SecurityScopes([Scope.SEE_METRICS]), users, bearer or token)
+    return PlainTextResponse(registry.expose(), media_type="text/plain; version=0.0.4")
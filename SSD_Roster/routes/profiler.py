@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+# standard library
+import asyncio
+from datetime import datetime
+
+# typing
+from typing import Annotated, Literal
+
+# fastapi
+from fastapi import APIRouter, HTTPException, Query, Security
+from fastapi.responses import Response
+
+# local
+from SSD_Roster.src.models import Scope, UserSchema
+from SSD_Roster.src.oauth2 import get_current_user
+from SSD_Roster.src.profiler import SamplingProfiler
+
+
+router = APIRouter(
+    prefix="/profiler",
+    tags=["profiler"],
+)
+
+_running = asyncio.Lock()  # one profile at a time (per worker), as every sample walks the stacks of every thread
+
+
+@router.get(
+    "/",
+    summary="Profiles the server for some seconds",
+    description=(
+        "Samples the stacks of every thread of the worker answering (the event loop's one included) and returns them "
+        "either as collapsed stacks (for flame graphs) or as a `pstats`-dump. Only one profile runs at a time."
+    ),
+    responses={
+        200: {"description": "Successful Response", "content": {"text/plain": {}, "application/octet-stream": {}}},
+        409: {"description": "Another profile is running"},
+    },
+    response_class=Response,
+)
+async def profile(
+    user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.PROFILE_SERVER])],
+    seconds: Annotated[float, Query(gt=0, le=60)] = 10,
+    interval: Annotated[float, Query(ge=0.001, le=0.1, description="Seconds between two samples.")] = 0.005,
+    format_: Annotated[Literal["collapsed", "pstats"], Query(alias="format")] = "collapsed",
+):
+    if _running.locked():
+        raise HTTPException(status_code=409, detail="Another profile is running, try again later")
+    async with _running:
+        profiler = SamplingProfiler(interval)
+        await asyncio.to_thread(profiler.run, seconds)  # the event loop keeps serving (and gets sampled) meanwhile
+
+    filename = f"SSD-profile-{datetime.utcnow():%Y%m%dT%H%M%S}"
+    if format_ == "pstats":
+        content, media_type, filename = profiler.pstats(), "application/octet-stream", f"{filename}.pstats"
+    else:
+        content, media_type, filename = profiler.collapsed(), "text/plain", f"{filename}.collapsed"
+    return Response(
+        content,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Profile-Samples": str(profiler.samples),
+        },
+        media_type=media_type,
+    )
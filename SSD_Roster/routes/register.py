@@ -5,16 +5,18 @@ from pydantic import EmailStr, PastDate
 from typing import Annotated
 
 # fastapi
-from fastapi import APIRouter, Form, Request
+from fastapi import APIRouter, Depends, Form, Request
 from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 
 # local
 from SSD_Roster.src.database import database
-from SSD_Roster.src.email import send_verification_email
+from SSD_Roster.src.email import email_outbox, queue_verification_email
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
 from SSD_Roster.src.messages import flash
-from SSD_Roster.src.models import MessageCategory, ResponseSchema, UserModel, VerificationCodesModel
+from SSD_Roster.src.models import MessageCategory, ResponseSchema, UserModel
+from SSD_Roster.src.sessions import load_session
 from SSD_Roster.src.templates import templates
-from SSD_Roster.src.verification import generate_code
+from SSD_Roster.src.verification import generate_code, store_code
 
 
 router = APIRouter(
@@ -27,6 +29,7 @@ router = APIRouter(
     "/",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def register(request: Request):
     return templates.TemplateResponse(request, "register.html")
@@ -36,15 +39,17 @@ async def register(request: Request):
     "/",
     include_in_schema=False,
     response_class=RedirectResponse,
+    dependencies=[Depends(load_session)],
 )
 async def manage_registration(
     request: Request,
     response: Response,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     username: Annotated[str, Form()] = None,
     email: Annotated[EmailStr, Form()] = None,
     birthday: Annotated[PastDate, Form()] = None,
 ):
-    data: ResponseSchema = await register_api(request, response, username, email, birthday)
+    data: ResponseSchema = await register_api(request, response, users, username, email, birthday)
 
     response.status_code = 302
 
@@ -70,12 +75,13 @@ async def manage_registration(
         201: {"model": ResponseSchema, "description": "Everything worked; a redirect is included"},
         400: {"model": ResponseSchema, "description": "Some form-fields are missing or not well formatted"},
         403: {"model": ResponseSchema, "description": "Already registered (E-Mail/username)"},
-        500: {"model": ResponseSchema, "description": "E-Mail could not be sent (or any other error...)"},
+        500: {"model": ResponseSchema, "description": "Any other error..."},
     },
 )
 async def register_api(
     request: Request,
     response: Response,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     username: Annotated[str, Form()] = None,
     email: Annotated[EmailStr, Form()] = None,
     birthday: Annotated[PastDate, Form()] = None,
@@ -90,41 +96,41 @@ async def register_api(
         return ResponseSchema(message="Following form-fields need to be set: " + ", ".join(missing), code=400)
 
     # email already used?
-    if await database.fetch_one(UserModel.select().where(UserModel.email == email)) is not None:
+    if await users.get_by("email", email) is not None:
         response.status_code = 403
         return ResponseSchema(message=f"The E-Mail {email} is already registered!", code=403)
 
     # username already used?
-    if await database.fetch_one(UserModel.select().where(UserModel.username == username)) is not None:
+    if await users.get_by("username", username) is not None:
         response.status_code = 403
         return ResponseSchema(message=f"The username {username} is already registered!", code=403)
 
-    user_id = await database.execute(
-        UserModel.insert().values(
-            username=username,
-            displayed_name=username,
-            email=email,
-            email_verified=False,
-            user_verified=False,
-            birthday=birthday,
-            password=None,
-            scopes="USER",
-        )
-    )
+    # the email is only sent if the user (and the code) got stored and vice versa
     code = generate_code()
-    await database.execute(VerificationCodesModel.insert().values(user_id=user_id, email=email, code=code))
-
-    if await send_verification_email(request, email, code):
-        response.status_code = 201
-        return ResponseSchema(
-            message=f"A code has been sent to {email}."
-            + (" Either enter it here or use the link in the mail." * (not request.url.path.endswith(".api"))),
-            code=201,
-            redirect=request.app.url_path_for("verify") + f"?email={email}",
+    async with database.transaction():
+        user_id = await database.execute(
+            UserModel.insert().values(
+                username=username,
+                displayed_name=username,
+                email=email,
+                email_verified=False,
+                user_verified=False,
+                birthday=birthday,
+                password=None,
+                scopes="USER",
+            )
         )
-    else:
-        response.status_code = 500
-        return ResponseSchema(message=f"No email has been send to {email}! Please contact an admin!", code=500)
+        await store_code(user_id, email, code)
+        await queue_verification_email(email, code)
+    email_outbox.notify()
+
+    response.status_code = 201
+    return ResponseSchema(
+        message=f"A code is on its way to {email}."
+        + (" Either enter it here or use the link in the mail." * (not request.url.path.endswith(".api"))),
+        code=201,
+        redirect=request.app.url_path_for("verify") + f"?email={email}",
+    )
 
 
 # ToDo: maybe endpoint for admins to create users (which are user-verified immediately, just email-verification missing
@@ -14,9 +14,12 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordRequestForm
 
 # local
+from SSD_Roster.src.environment import settings
 from SSD_Roster.src.messages import flash
 from SSD_Roster.src.models import MessageCategory
 from SSD_Roster.src.oauth2 import authenticate_user, create_access_token
+from SSD_Roster.src.sessions import load_session
+from SSD_Roster.src.static import static_files
 from SSD_Roster.src.templates import templates
 
 
@@ -27,10 +30,12 @@ router = APIRouter()
     "/",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def root(request: Request):
-    for category in MessageCategory:  # type: ignore  # ToDo: remove in demo messages
-        flash(request, f"A demo message with category {category}", category)
+    if settings.ENVIRONMENT == "development":
+        for category in MessageCategory:  # type: ignore  # ToDo: remove in demo messages
+            flash(request, f"A demo message with category {category}", category)
     return templates.TemplateResponse(request, "root.html")
 
 
@@ -39,7 +44,7 @@ def setup(app: FastAPI):
 
     @app.get("/favicon.ico", include_in_schema=False)
     async def favicon():
-        return RedirectResponse("/static/favicon/favicon.ico")
+        return RedirectResponse(static_files.url("favicon/favicon.ico"))
 
     @app.get("/docs", include_in_schema=False)
     async def custom_swagger_ui_html():
@@ -47,8 +52,8 @@ def setup(app: FastAPI):
             openapi_url=app.openapi_url,
             title=app.title + " - Swagger UI",
             oauth2_redirect_url=app.swagger_ui_oauth2_redirect_url,
-            swagger_js_url="/static/swagger-ui-bundle.js",
-            swagger_css_url="/static/swagger-ui.css",
+            swagger_js_url=static_files.url("swagger-ui-bundle.js"),
+            swagger_css_url=static_files.url("swagger-ui.css"),
             swagger_favicon_url=app.url_path_for("favicon"),
         )
 
@@ -61,7 +66,7 @@ def setup(app: FastAPI):
         return get_redoc_html(
             openapi_url=app.openapi_url,
             title=app.title + " - ReDoc",
-            redoc_js_url="/static/redoc.standalone.js",
+            redoc_js_url=static_files.url("redoc.standalone.js"),
             redoc_favicon_url=app.url_path_for("favicon"),
         )
 
@@ -5,29 +5,34 @@ import asyncio
 from datetime import datetime
 
 # typing
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Optional
 
 # fastapi
-from fastapi import APIRouter, Request, Security
-from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
+from fastapi import APIRouter, Body, Depends, Query, Request, Security
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response, StreamingResponse
 
 # local
 from SSD_Roster.src.database import database
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
 from SSD_Roster.src.models import (
     GroupedScope,
+    IsoWeek,
     ResponseSchema,
     RosterModel,
     RosterResponseSchema,
     RosterSchema,
     Scope,
-    UserModel,
+    UserMatrix,
     UserSchema,
     Week,
     Year,
 )
+from SSD_Roster.src.notifications import Audience, roster_notifier
 from SSD_Roster.src.oauth2 import get_current_user
-from SSD_Roster.src.roster import Roster
+from SSD_Roster.src.roster import publish_roster, Roster, roster_broadcaster
+from SSD_Roster.src.sessions import load_session
 from SSD_Roster.src.templates import templates
+from SSD_Roster.src.timetable import parse_iso_week
 
 
 router = APIRouter(
@@ -35,6 +40,10 @@ router = APIRouter(
     tags=["roster"],
 )
 
+MAX_EVENT_TOPICS = 53  # weeks per connection
+EVENTS_QUEUE_SIZE = 100  # per connection, older events are dropped for slow clients
+EVENTS_KEEP_ALIVE = 15  # seconds
+
 
 @router.get(
     "/",
@@ -86,11 +95,13 @@ async def roster_pdf_api() -> ResponseSchema:
     "/{year}/{week}/",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def see_roster(
     request: Request,
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_ROSTER])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     year: Year,
     week: Week,
 ):
@@ -99,24 +110,17 @@ async def see_roster(
     data: RosterResponseSchema = await see_roster_api(response, user, year, week)
     rstr: RosterSchema = data.roster
     matrix = []
-    _cache: dict[int | None, str] = {
-        rstr.published_by: await database.fetch_one(UserModel.select().where(UserModel.user_id == rstr.published_by))
-        or f"User #{rstr.published_by}",
-        None: "",
-    }
+    # every assigned user (and the publisher) with a single query
+    _users = await users.get_many(
+        [rstr.published_by, *(_user for day in rstr.user_matrix for shift in day for _user in shift)]
+    )
+    _names: dict[int | None, str] = {None: ""} | {_id: _u.displayed_name for _id, _u in _users.items()}
     for day in rstr.user_matrix:
         matrix.append([])
         for shift in day:
             matrix[-1].append([])
             for _user in shift:
-                if (_u := _cache.get(_user)) is None:
-                    if (
-                        _u := await database.fetch_one(UserModel.select().where(UserModel.user_id == _user))
-                    ) is not None:
-                        _cache[_user] = _u.displayed_name
-                    else:
-                        _cache[_user] = _u = f"User #{_user}"
-                matrix[-1][-1].append(_u)
+                matrix[-1][-1].append(_names.get(_user, f"User #{_user}"))
 
     return templates.TemplateResponse(
         request,
@@ -125,8 +129,8 @@ async def see_roster(
             "week": rstr.date_anchor[1],
             "year": rstr.date_anchor[0],
             "published": rstr.published_at,
-            "user": rstr.published_by,
-            "user_url": request.app.url_path_for("user", user_id=rstr.published_by) if rstr.published_by else "#",
+            "user": _names.get(rstr.published_by, f"User #{rstr.published_by}"),
+            "user_url": request.app.url_path_for("see_user", user_id=rstr.published_by) if rstr.published_by else "#",
             "public_download": Scope.DOWNLOAD_ROSTER.value in GroupedScope.PUBLIC,
             "matrix": matrix,
         },
@@ -201,6 +205,99 @@ async def download_roster(
     )
 
 
+@router.post(
+    "/{year}/{week}/.api",
+    summary="Publishes (or replaces) the official roster",
+    description="Afterwards the `assigned` users (or `everyone` who may see the roster) are notified in the "
+    "background with an inbox message and, if `email` is set, an email.",
+    responses={
+        200: {"model": RosterResponseSchema, "description": "Roster published"},
+        400: {"model": ResponseSchema, "description": "Unknown users assigned"},
+    },
+    response_class=ORJSONResponse,
+)
+async def publish_roster_api(
+    response: Response,
+    user: Annotated[UserSchema, Security(get_current_user, scopes=[Scope.PUBLISH_ROSTER])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
+    year: Year,
+    week: Week,
+    user_matrix: Annotated[UserMatrix, Body(embed=True)],
+    notify: Annotated[Audience, Body(embed=True)] = "assigned",
+    email: Annotated[bool, Body(embed=True)] = True,
+) -> RosterResponseSchema | ResponseSchema:
+    assigned = {_user for day in user_matrix for shift in day for _user in shift if _user is not None}
+    if unknown := assigned - (await users.get_many(assigned)).keys():
+        response.status_code = 400
+        return ResponseSchema(message=f"Unknown user(s): {', '.join(map(str, sorted(unknown)))}", code=400)
+
+    roster_ = await publish_roster(
+        RosterSchema(user_matrix=user_matrix, date_anchor=(year, week), published_by=None, published_at=None),
+        user.user_id,
+    )
+    roster_notifier.submit(roster_, notify, email)  # in the background, the response doesn't wait for it
+    response.status_code = 200
+    return RosterResponseSchema(
+        message=f"Published roster for year {year} and week {week}",
+        code=200,
+        roster=roster_,
+    )
+
+
+@router.get(
+    "/events",
+    summary="Stream of roster publications (Server-Sent Events)",
+    description="Every publication of a subscribed week is sent as `roster`-event with the changed slots as "
+    "`[day, shift, position, user_id]` (all of them if the roster is new). Subscribes to the current week if no "
+    "`week` is given.",
+    responses={
+        200: {"description": "Event stream", "content": {"text/event-stream": {}}},
+        400: {"model": ResponseSchema, "description": "Invalid weeks"},
+    },
+    response_class=StreamingResponse,
+)
+async def roster_events(
+    request: Request,
+    user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_ROSTER])],
+    week: Annotated[Optional[list[IsoWeek]], Query()] = None,
+):
+    try:
+        topics = {parse_iso_week(iso_week) for iso_week in week or ()}
+    except ValueError as e:
+        return ORJSONResponse(ResponseSchema(message=str(e), code=400).model_dump(), status_code=400)
+    if len(topics) > MAX_EVENT_TOPICS:
+        return ORJSONResponse(
+            ResponseSchema(message=f"At most {MAX_EVENT_TOPICS} weeks per stream", code=400).model_dump(),
+            status_code=400,
+        )
+    if not topics:
+        iso = datetime.utcnow().isocalendar()
+        topics = {(iso.year, iso.week)}
+
+    async def events() -> AsyncIterator[bytes]:
+        subscription = roster_broadcaster.subscribe(topics, EVENTS_QUEUE_SIZE)
+        try:
+            yield b"retry: 3000\n\n"
+            dropped = 0
+            while not await request.is_disconnected():
+                _events = await subscription.get(timeout=EVENTS_KEEP_ALIVE)
+                if subscription.dropped != dropped:  # the client should re-fetch the rosters
+                    yield b"event: dropped\ndata: %d\n\n" % (subscription.dropped - dropped)
+                    dropped = subscription.dropped
+                if not _events:
+                    yield b": keep-alive\n\n"
+                for event in _events:
+                    yield event
+        finally:
+            roster_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # ToDo: endpoint to create & submit an own roster
 # ToDo: endpoint to approve a roster
 
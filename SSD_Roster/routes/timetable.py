@@ -3,28 +3,35 @@ from __future__ import annotations
 # standard library
 from datetime import datetime, timedelta
 
+# third party
+from sqlalchemy import tuple_
+
 # typing
 from typing import Annotated
 
 # fastapi
-from fastapi import APIRouter, Form, Request, Security
+from fastapi import APIRouter, Body, Depends, Form, Query, Request, Security
 from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 
 # local
 from SSD_Roster.src.database import database
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
 from SSD_Roster.src.models import (
+    IsoWeek,
     PageID,
+    ResponseSchema,
     Scope,
     TimetableModel,
+    TimetableRangeResponseSchema,
     TimetableResponseSchema,
     TimetableSchema,
     UserID,
-    UserModel,
     UserSchema,
 )
 from SSD_Roster.src.oauth2 import get_current_user
+from SSD_Roster.src.sessions import load_session
 from SSD_Roster.src.templates import templates
-from SSD_Roster.src.timetable import Timetable
+from SSD_Roster.src.timetable import is_existing_week, iter_weeks, parse_iso_week, Timetable, upsert_timetables
 
 
 router = APIRouter(
@@ -32,6 +39,8 @@ router = APIRouter(
     tags=["timetable"],
 )
 
+MAX_RANGE_WEEKS = 53  # a whole year at most
+
 
 @router.get(
     "/",
@@ -49,14 +58,16 @@ async def overview():
     # summary="Edit personal timetable",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def edit_timetable(
     request: Request,
     user: Annotated[UserSchema, Security(get_current_user, scopes=[Scope.MANAGE_OWN_CALENDAR])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     page: PageID = 0,
 ):
     date = datetime.utcnow() + timedelta(weeks=page)
-    year = date.year
+    year = date.isocalendar().year
     week = date.isocalendar().week
 
     # navigation
@@ -75,7 +86,7 @@ async def edit_timetable(
         timetable_ = Timetable(**TimetableModel.to_schema(db_timetable).model_dump())
         matrix = timetable_.availability_matrix
 
-    owner = await database.fetch_one(UserModel.select().where(UserModel.user_id == user.user_id))
+    owner = await users.get(user.user_id)
 
     return templates.TemplateResponse(
         request,
@@ -108,7 +119,7 @@ async def submit_timetable(
     page: Annotated[PageID, Form()] = 0,
 ):
     date = datetime.utcnow() + timedelta(weeks=page)
-    year = date.year
+    year = date.isocalendar().year
     week = date.isocalendar().week
 
     timetable = Timetable(user_id=user.user_id, date_anchor=(year, week))
@@ -116,13 +127,46 @@ async def submit_timetable(
         list(filter(lambda t: len(t[0]) == 2 and t[0].isnumeric(), (await request.form()).items()))
     )
 
-    # ToDo: update database
-    # await database.execute(timetable.to_model().insert())  /!\
+    await upsert_timetables([timetable])
 
     response.status_code = 302
     return request.app.url_path_for("edit_timetable")
 
 
+@router.post(
+    "/submit.api",
+    summary="Submit the own timetable for one or more weeks",
+    responses={
+        200: {"model": ResponseSchema, "description": "Every week got saved"},
+        400: {"model": ResponseSchema, "description": "Too many or non-existing weeks"},
+        403: {"model": ResponseSchema, "description": "Timetables of other users can't be submitted"},
+    },
+    response_class=ORJSONResponse,
+)
+async def submit_timetable_api(
+    response: Response,
+    user: Annotated[UserSchema, Security(get_current_user, scopes=[Scope.MANAGE_OWN_CALENDAR])],
+    timetables: Annotated[list[TimetableSchema], Body()],
+) -> ResponseSchema:
+    if not 0 < len(timetables) <= MAX_RANGE_WEEKS:
+        response.status_code = 400
+        return ResponseSchema(message=f"Between 1 and {MAX_RANGE_WEEKS} weeks can be submitted at once!", code=400)
+
+    for timetable in timetables:
+        if timetable.user_id != user.user_id:
+            response.status_code = 403
+            return ResponseSchema(message="You can only submit your own timetable!", code=403)
+        if not is_existing_week(*timetable.date_anchor):
+            response.status_code = 400
+            return ResponseSchema(
+                message="The week {1} doesn't exist in year {0}!".format(*timetable.date_anchor), code=400
+            )
+
+    count = await upsert_timetables(timetables)
+    response.status_code = 200
+    return ResponseSchema(message=f"Saved your timetable for {count} week{'s'*(count!=1)}", code=200)
+
+
 @router.get(
     "/{user_id}.api",
     summary="The timetable of an user",
@@ -139,7 +183,7 @@ async def see_users_timetable_api(
     page: PageID = 0,
 ) -> TimetableResponseSchema:
     date = datetime.utcnow() + timedelta(weeks=page)
-    year = date.year
+    year = date.isocalendar().year
     week = date.isocalendar().week
 
     db_timetable: TimetableModel | None = await database.fetch_one(
@@ -167,15 +211,82 @@ async def see_users_timetable_api(
         )
 
 
+@router.get(
+    "/{user_id}/range.api",
+    summary="The timetables of an user for multiple weeks",
+    responses={
+        200: {"model": TimetableRangeResponseSchema, "description": "Timetables (missing weeks are filled)"},
+        400: {"model": ResponseSchema, "description": "Invalid range"},
+    },
+    response_class=ORJSONResponse,
+)
+async def see_users_timetable_range_api(
+    response: Response,
+    user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_OTHERS_CALENDAR])],
+    user_id: UserID,
+    from_: Annotated[IsoWeek, Query(alias="from")],
+    to: IsoWeek,
+) -> TimetableRangeResponseSchema | ResponseSchema:
+    try:
+        start, stop = parse_iso_week(from_), parse_iso_week(to)
+    except ValueError:
+        response.status_code = 400
+        return ResponseSchema(message=f"Either {from_} or {to} isn't an existing week!", code=400)
+
+    weeks = list(iter_weeks(start, stop))
+    if not 0 < len(weeks) <= MAX_RANGE_WEEKS:
+        response.status_code = 400
+        return ResponseSchema(
+            message=f"The range from {from_} to {to} has to contain between 1 and {MAX_RANGE_WEEKS} weeks!",
+            code=400,
+        )
+
+    # one query for the whole range (covered by the (user_id, year, week)-index)
+    stored: dict[tuple[int, int], TimetableSchema] = {
+        (db_timetable.year, db_timetable.week): TimetableModel.to_schema(db_timetable)
+        for db_timetable in await database.fetch_all(
+            TimetableModel.select().where(
+                TimetableModel.user_id == user_id,
+                tuple_(TimetableModel.year, TimetableModel.week).between(start, stop),
+            )
+        )
+    }
+
+    timetables: list[Timetable] = []
+    missing: list[tuple[int, int]] = []
+    for year, week in weeks:
+        if (timetable_ := stored.get((year, week))) is None:
+            missing.append((year, week))
+            timetables.append(Timetable(user_id=user_id, date_anchor=(year, week)))
+        else:
+            timetables.append(Timetable(**timetable_.model_dump()))
+
+    count = len(weeks)
+    response.status_code = 200
+    return TimetableRangeResponseSchema(
+        message=f"Timetables for {count} week{'s'*(count!=1)} from {from_} to {to} "
+        f"({count - len(missing)} stored, {len(missing)} filled with defaults)",
+        code=200,
+        user_id=user_id,
+        count=count,
+        weeks=weeks,
+        missing=missing,
+        timetables=timetables,
+        compact=[timetable_.to_compact() for timetable_ in timetables],
+    )
+
+
 @router.get(
     "/{user_id}",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def see_users_timetable(
     request: Request,
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_OTHERS_CALENDAR])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     user_id: UserID,
     page: PageID = 0,
 ):
@@ -190,7 +301,7 @@ async def see_users_timetable(
         {
             "week": data.timetable.date_anchor[1],
             "year": data.timetable.date_anchor[0],
-            "user": await database.fetch_one(UserModel.select().where(UserModel.user_id == data.timetable.user_id)),
+            "user": await users.get(data.timetable.user_id),
             "before": f"{url}?page={max(page - 1, 0)}",
             "current": f"{url}?page=0",
             "after": f"{url}?page={page + 1}",
@@ -8,9 +8,9 @@ from fastapi import APIRouter, Depends, Request, Security
 from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 
 # local
-from SSD_Roster.src.database import database
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
+from SSD_Roster.src.messages import get_messages_for
 from SSD_Roster.src.models import (
-    MessageSchema,
     MessagesResponseSchema,
     MinimalUserSchema,
     ResponseSchema,
@@ -39,9 +39,10 @@ router = APIRouter(
 async def users(
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_USERS])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
 ):
     # ToDo: make a nice page with data
-    data = await users_api(response, user)
+    data = await users_api(response, user, users)
     response.status_code = data.code
     return __import__("orjson").dumps(data.model_dump(mode="json"))
 
@@ -57,9 +58,10 @@ async def users(
 async def users_api(
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_USERS])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
 ) -> UsersResponseSchema | ResponseSchema:
     all_users: list[MinimalUserSchema] = []
-    for db_user in await database.fetch_all(UserModel.select()):
+    for db_user in await users.get_all():
         all_users.append(
             MinimalUserSchema(
                 user_id=db_user.user_id,
@@ -146,7 +148,7 @@ async def get_messages_api(
             redirect=request.app.url_path_for("login"),
         )
 
-    messages: list[MessageSchema] = []  # ToDo: connect to database
+    messages = await get_messages_for(user.user_id)
     count = len(messages)
     response.status_code = 200
     return MessagesResponseSchema(
@@ -170,9 +172,10 @@ async def see_user_api(
     request: Request,
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_USERS])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     user_id: UserID,
 ) -> UserResponseSchema | ResponseSchema:
-    if (requested_user := await database.fetch_one(UserModel.select().where(UserModel.user_id == user_id))) is None:
+    if (requested_user := await users.get(user_id)) is None:
         response.status_code = 404
         return ResponseSchema(
             message=f"Unable to find user with ID {user_id}",
@@ -205,9 +208,10 @@ async def see_user(
     request: Request,
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.SEE_USERS])],
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     user_id: UserID,
 ):
     # ToDo: make a nice page with data
-    data = await see_user_api(request, response, user, user_id)
+    data = await see_user_api(request, response, user, users, user_id)
     response.status_code = data.code
     return __import__("orjson").dumps(data.model_dump(mode="json"))
@@ -5,27 +5,31 @@ from pydantic import EmailStr, SecretStr
 from typing import Annotated, Optional
 
 # fastapi
-from fastapi import APIRouter, Form, Request, Security
+from fastapi import APIRouter, Depends, Form, Query, Request, Security
 from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 
 # local
 from SSD_Roster.src.database import database
+from SSD_Roster.src.identity_map import get_user_identity_map, UserIdentityMap
 from SSD_Roster.src.messages import flash
 from SSD_Roster.src.models import (
     MessageCategory,
-    MinimalUserSchema,
+    PageID,
+    QueueDecisionResponseSchema,
+    QueuedUserSchema,
     ResponseSchema,
     Scope,
     UserID,
     UserModel,
     UserSchema,
-    UsersResponseSchema,
     VerificationCodesModel,
+    VerificationQueueResponseSchema,
 )
 from SSD_Roster.src.oauth2 import get_current_user, get_password_hash
+from SSD_Roster.src.sessions import load_session
 from SSD_Roster.src.templates import templates
 from SSD_Roster.src.utils import calculate_age
-from SSD_Roster.src.verification import verify_code
+from SSD_Roster.src.verification import accept_users, get_queue, reject_users, verify_code
 
 
 router = APIRouter(
@@ -38,6 +42,7 @@ router = APIRouter(
     "/",
     include_in_schema=False,
     response_class=HTMLResponse,
+    dependencies=[Depends(load_session)],
 )
 async def verify(
     request: Request,
@@ -51,15 +56,17 @@ async def verify(
     "/",
     include_in_schema=False,
     response_class=RedirectResponse,
+    dependencies=[Depends(load_session)],
 )
 async def manage_verification(
     request: Request,
     response: Response,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     email: Annotated[EmailStr, Form()] = None,
     code: Annotated[str, Form()] = None,
     password: Annotated[SecretStr, Form()] = None,
 ):
-    data: ResponseSchema = await manage_verification_api(request, response, email, code, password)
+    data: ResponseSchema = await manage_verification_api(request, response, users, email, code, password)
 
     if data.code == 200:
         flash(request, data.message, MessageCategory.SUCCESS)
@@ -83,6 +90,7 @@ async def manage_verification(
 async def manage_verification_api(
     request: Request,
     response: Response,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     email: Annotated[EmailStr, Form()] = None,
     code: Annotated[str, Form()] = None,
     password: Annotated[SecretStr, Form()] = None,
@@ -105,7 +113,7 @@ async def manage_verification_api(
         )
 
     # invalid email?
-    if (user := await database.fetch_one(UserModel.select().where(UserModel.email == email))) is None:
+    if (user := await users.get_by("email", email)) is None:
         response.status_code = 401
         return ResponseSchema(message=f"Invalid email {email}!", code=401)
 
@@ -120,6 +128,7 @@ async def manage_verification_api(
         .where(UserModel.email == user.email)
         .values(password=get_password_hash(password), email_verified=True)
     )
+    users.invalidate(user.user_id)
 
     await database.execute(VerificationCodesModel.delete().where(VerificationCodesModel.user_id == user.user_id))
 
@@ -143,9 +152,11 @@ async def admin_queue(
     request: Request,
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.MANAGE_USERS])],
+    page: PageID = 0,
+    per_page: Annotated[int, Query(ge=1, le=500)] = 100,
 ):
     # ToDo: make a nice page with data
-    data = await admin_queue_api(response, user)
+    data = await admin_queue_api(response, user, page, per_page)
     response.status_code = data.code
     return __import__("orjson").dumps(data.model_dump(mode="json"))
 
@@ -154,58 +165,85 @@ async def admin_queue(
     "/queue/.api",
     summary="Queue for verification by admins",
     responses={
-        200: {"model": ResponseSchema, "description": "The entire queue"},
+        200: {"model": VerificationQueueResponseSchema, "description": "One page of the queue"},
     },
     response_class=ORJSONResponse,
 )
 async def admin_queue_api(
     response: Response,
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.MANAGE_USERS])],
-) -> UsersResponseSchema:
-    all_users: list[MinimalUserSchema] = []
-    for db_user in await database.fetch_all(VerificationCodesModel.select()):
-        all_users.append(
-            MinimalUserSchema(
-                user_id=db_user.user_id,
-                email=db_user.email,
-                displayed_name=db_user.displayed_name,
-                age=calculate_age(db_user.birthday),
-                scopes=db_user.scopes,
-            )
+    page: PageID = 0,
+    per_page: Annotated[int, Query(ge=1, le=500)] = 100,
+) -> VerificationQueueResponseSchema:
+    rows, total = await get_queue(page * per_page, per_page)
+    queued = [
+        QueuedUserSchema(
+            user_id=row.user_id,
+            email=row.email,
+            displayed_name=row.displayed_name,
+            age=calculate_age(row.birthday),
+            scopes=row.scopes,
+            email_verified=row.email_verified,
+            code_expires_at=row.code_expires_at,
         )
-
-    count = len(all_users)
+        for row in rows
+    ]
 
     response.status_code = 200
-    return UsersResponseSchema(
-        message=f"Queue containing {count} user{'s'*(count!=1)}",
+    return VerificationQueueResponseSchema(
+        message=f"Queue containing {total} user{'s'*(total!=1)}",
         code=200,
-        count=count,
-        users=all_users,
+        count=len(queued),
+        users=queued,
+        total=total,
+        page=page,
+        per_page=per_page,
     )
 
 
 @router.post(
     "/queue/accept",
-    summary="Accept a user from queue",
+    summary="Accept users from queue",
+    description="Every `user_id` which is still in the queue is verified (all of them in one transaction).",
+    responses={
+        200: {"model": QueueDecisionResponseSchema, "description": "The accepted users"},
+    },
     response_class=ORJSONResponse,
 )
 async def admin_accept(
-    request: Request,
     response: Response,
-    user_id: Annotated[UserID, Form()],
+    user_ids: Annotated[list[UserID], Form(alias="user_id")],
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.MANAGE_USERS])],
-): ...  # ToDo: accept user
+) -> QueueDecisionResponseSchema:
+    accepted = await accept_users(user_ids)
+
+    response.status_code = 200
+    return QueueDecisionResponseSchema(
+        message=f"Accepted {len(accepted)} user{'s'*(len(accepted)!=1)}",
+        code=200,
+        user_ids=accepted,
+    )
 
 
 @router.post(
     "/queue/reject",
-    summary="Reject a user from queue",
+    summary="Reject users from queue",
+    description="Every `user_id` which is still in the queue is deleted (all of them in one transaction).",
+    responses={
+        200: {"model": QueueDecisionResponseSchema, "description": "The rejected users"},
+    },
     response_class=ORJSONResponse,
 )
 async def admin_reject(
-    request: Request,
     response: Response,
-    user_id: Annotated[UserID, Form()],
+    user_ids: Annotated[list[UserID], Form(alias="user_id")],
     user: Annotated[UserSchema | None, Security(get_current_user, scopes=[Scope.MANAGE_USERS])],
-): ...  # ToDo: reject user
+) -> QueueDecisionResponseSchema:
+    rejected = await reject_users(user_ids)
+
+    response.status_code = 200
+    return QueueDecisionResponseSchema(
+        message=f"Rejected {len(rejected)} user{'s'*(len(rejected)!=1)}",
+        code=200,
+        user_ids=rejected,
+    )
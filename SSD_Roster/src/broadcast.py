@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "EventSubscription",
+    "EventBroadcaster",
+)
+
+
+# standard library
+import asyncio
+from collections import deque
+from itertools import count
+
+# third party
+import orjson
+
+# typing
+from typing import Any, Hashable, Iterable, Optional
+
+
+class EventSubscription:
+    """Bounded queue of Server-Sent Events (already encoded) for one connection; once full the oldest are dropped"""
+
+    def __init__(self, topics: Iterable[Hashable], maxsize: int):
+        self.topics = frozenset(topics)
+        self._queue: deque[bytes] = deque(maxlen=maxsize)
+        self._event = asyncio.Event()
+        self.dropped: int = 0
+        """Amount of events which were dropped as the connection was too slow."""
+
+    def push(self, event: bytes) -> None:
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(event)
+        self._event.set()
+
+    async def get(self, timeout: Optional[float] = None) -> list[bytes]:
+        """Waits for new events and returns all of them (an empty list if ``timeout`` passed)"""
+        if not self._queue:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._event.clear()
+        events = list(self._queue)
+        self._queue.clear()
+        return events
+
+
+class EventBroadcaster:
+    """Fans events out to every subscription of their topic from a single task
+
+    ``publish`` only enqueues the event, so publishers never wait for the subscribers. The task encodes every event
+    once and hands the same bytes to all of the topic's subscriptions. Everything happens within one event loop,
+    so this isn't shared between workers.
+    """
+
+    def __init__(self):
+        self._topics: dict[Hashable, set[EventSubscription]] = {}
+        self._queue: asyncio.Queue[tuple[Hashable, str, Any]] = asyncio.Queue()
+        self._ids = count(1)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="event-broadcaster")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, topics: Iterable[Hashable], maxsize: int = 100) -> EventSubscription:
+        """Don't forget to ``unsubscribe``"""
+        subscription = EventSubscription(topics, maxsize)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: EventSubscription) -> None:
+        for topic in subscription.topics:
+            if subscriptions := self._topics.get(topic):
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._topics[topic]
+
+    def subscribers(self, topic: Hashable) -> int:
+        return len(self._topics.get(topic, ()))
+
+    def publish(self, topic: Hashable, event: str, data: Any) -> None:
+        """``data`` has to be serializable by ``orjson``"""
+        self._queue.put_nowait((topic, event, data))
+        self.start()
+
+    async def _run(self) -> None:
+        while True:
+            topic, event, data = await self._queue.get()
+            if not (subscriptions := self._topics.get(topic)):
+                continue
+            encoded = b"id: %d\nevent: %b\ndata: %b\n\n" % (next(self._ids), event.encode(), orjson.dumps(data))
+            for subscription in tuple(subscriptions):
+                subscription.push(encoded)
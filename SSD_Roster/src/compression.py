@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+
+__all__ = ("CompressionMiddleware",)
+
+
+# standard library
+import asyncio
+import zlib
+
+# third party
+import brotli
+
+# typing
+from typing import Callable, Optional
+
+# fastapi
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# local
+from .static import accepted_encodings
+
+
+class _Compressor:
+    """Streaming compressor of one encoding; ``compress`` flushes, so every chunk can be sent right away"""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=brotli_quality)
+            self._process: Callable[[bytes], bytes] = lambda data: compressor.process(data) + compressor.flush()
+            self._finish: Callable[[], bytes] = compressor.finish
+        else:
+            compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # 31: with gzip-header
+            self._process = lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._finish = compressor.flush
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        return self._process(data) + self._finish() if last else self._process(data)
+
+
+class CompressionMiddleware:
+    """Compresses responses with brotli or gzip (as accepted by the client)
+
+    Only responses of ``CONTENT_TYPES`` with at least ``minimum_size`` bytes are compressed; responses which already
+    have a ``Content-Encoding`` and paths starting with one of ``exclude_paths`` (the precompressed static files)
+    are passed through. Bodies of more than ``THREAD_THRESHOLD`` bytes are compressed in a thread, so the event loop
+    isn't blocked by them. Streamed responses are compressed chunk by chunk (each one flushed), so they still stream.
+    """
+
+    CONTENT_TYPES = frozenset(
+        {
+            "text/html",
+            "text/css",
+            "text/plain",
+            "text/javascript",
+            "application/javascript",
+            "application/json",
+            "application/xml",
+            "image/svg+xml",
+        }
+    )  # e.g. PDFs (already compressed) and Server-Sent Events (have to be sent as soon as possible) aren't part of it
+    ENCODINGS = ("br", "gzip")  # in order of preference
+    THREAD_THRESHOLD = 64 * 1024  # bytes
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,  # higher qualities are too slow for responses which are compressed every time
+        exclude_paths: tuple[str, ...] = ("/static/",),
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.exclude_paths = exclude_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD" or scope["path"].startswith(self.exclude_paths):
+            return await self.app(scope, receive, send)
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if (encoding := next((e for e in self.ENCODINGS if e in accepted), None)) is None:
+            return await self.app(scope, receive, send)
+
+        start: Optional[Message] = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def compress(data: bytes, last: bool) -> bytes:
+            if len(data) > self.THREAD_THRESHOLD:
+                return await asyncio.to_thread(compressor.compress, data, last)
+            return compressor.compress(data, last)
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start, compressor, passthrough
+            if passthrough:
+                return await send(message)
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message.get("headers", []))
+                content_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+                if (
+                    message["status"] < 200
+                    or message["status"] in (204, 304)
+                    or "content-encoding" in headers
+                    or content_type not in self.CONTENT_TYPES
+                    or int(headers.get("content-length", self.minimum_size)) < self.minimum_size
+                ):
+                    passthrough = True
+                    return await send(message)
+                start = message  # sent with the first body, once it's known whether it's compressed
+                return None
+
+            if message["type"] != "http.response.body" or start is None:  # e.g. ``http.response.debug``
+                return await send(message)
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            headers = MutableHeaders(scope=start)
+            if compressor is None:
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    return await send(message)
+                compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+                body = await compress(body, not more_body)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if etag := headers.get("etag"):  # the representation differs, so it's only weakly equal
+                    headers["ETag"] = etag if etag.startswith("W/") else f"W/{etag}"
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+            else:
+                body = await compress(body, not more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -2,33 +2,310 @@ from __future__ import annotations
 
 
 __all__ = (
+    "QueryRecord",
+    "QueryLog",
+    "query_log",
+    "QueryLogMiddleware",
+    "InstrumentedDatabase",
     "database",
+    "insert_many",
     "setup",
 )
 
 
 # standard library
-from datetime import date
+import re
+import sys
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 
 # third party
 import databases
-from sqlalchemy import create_engine
+from databases.interfaces import Record
+from sqlalchemy import create_engine, func, inspect, select, Table, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.sql import ClauseElement
+
+# typing
+from typing import Any, AsyncGenerator, Callable, Iterable, Mapping, NamedTuple, Optional
+
+# fastapi
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # local
 from .abc import DBBaseModel
 from .environment import settings
-from .models import GroupedScope, UserModel
+from .metrics import cache_lookups, db_queries, db_query_duration
+from .models import GroupedScope, MessageModel, RosterModel, UnreadCountModel, UserModel, VerificationCodesModel
+
+
+_dialect = sqlite.dialect(paramstyle="qmark")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+_FINGERPRINTS_SIZE = 1024
+_fingerprints: OrderedDict[Any, str] = OrderedDict()
+"""Fingerprints by SQLAlchemy's cache key of the statement (which leaves out the bound values) or by the SQL text."""
+
+
+def _fingerprint(query: ClauseElement | str) -> str:
+    """The SQL of the query with its parameters as placeholders, so the same query with other values is equal
+
+    Statements are built anew for every call, so they're looked up by their cache key; only unknown ones get compiled.
+    """
+    if isinstance(query, ClauseElement):
+        if (cache_key := query._generate_cache_key()) is None:  # not cacheable (rare), compiled every time
+            return _WHITESPACE.sub(" ", str(query.compile(dialect=_dialect))).strip()
+        key = cache_key.key
+    else:
+        key = query
+
+    if (fingerprint := _fingerprints.get(key)) is not None:
+        cache_lookups.inc(("query_fingerprint", "hit"))
+        _fingerprints.move_to_end(key)
+        return fingerprint
+
+    cache_lookups.inc(("query_fingerprint", "miss"))
+    if isinstance(query, ClauseElement):
+        sql = str(query.compile(dialect=_dialect))  # bound values already are placeholders (``IN`` as one)
+    else:
+        sql = _LITERALS.sub("?", query)
+    fingerprint = _fingerprints[key] = _WHITESPACE.sub(" ", sql).strip()
+    if len(_fingerprints) > _FINGERPRINTS_SIZE:
+        _fingerprints.popitem(last=False)
+    return fingerprint
+
+
+class QueryRecord(NamedTuple):
+    fingerprint: str
+    operation: str
+    duration: float  # seconds
+    rows: Optional[int]  # ``None`` if unknown (e.g. for ``execute``)
+
+
+class QueryLog:
+    """The queries of one request"""
+
+    MAX_RECORDS = 1000  # the counts keep counting beyond it, only the records are dropped
+
+    def __init__(self):
+        self.records: list[QueryRecord] = []
+        self.fingerprints: Counter[str] = Counter()
+        self.count: int = 0
+        self.duration: float = 0
+
+    def add(self, record: QueryRecord) -> None:
+        if len(self.records) < self.MAX_RECORDS:
+            self.records.append(record)
+        self.fingerprints[record.fingerprint] += 1
+        self.count += 1
+        self.duration += record.duration
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """Fingerprints which ran more than ``threshold`` times (most frequent first), usually an N+1-pattern"""
+        return [(fingerprint, n) for fingerprint, n in self.fingerprints.most_common() if n > threshold]
+
+
+query_log: ContextVar[Optional[QueryLog]] = ContextVar("query_log", default=None)
+"""Queries of the request which is currently handled (``None`` outside of requests or if disabled)."""
+
+
+class QueryLogMiddleware:
+    """Records the queries of every HTTP request and warns about queries which ran more than ``threshold`` times
+
+    With ``server_timing`` the amount and duration of the queries until the response is started are sent as a
+    ``Server-Timing``-header (meant for development, as it tells a lot about the internals).
+    """
+
+    def __init__(self, app: ASGIApp, threshold: int = 10, server_timing: bool = False):
+        self.app = app
+        self.threshold = threshold
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        log = QueryLog()
+        token = query_log.set(log)
+        start = time.perf_counter()
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start" and self.server_timing:
+                timing = (
+                    f'db;dur={log.duration * 1000:.1f};desc="{log.count} queries", '
+                    f"total;dur={(time.perf_counter() - start) * 1000:.1f}"
+                )
+                message["headers"] = [*message.get("headers", ()), (b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            query_log.reset(token)
+            for fingerprint, n in log.repeated(self.threshold):
+                sys.stderr.write(
+                    f"WARNING: {scope['method']} {scope['path']}: the same query ran {n} times (N+1?): "
+                    f"{fingerprint[:300]}\n"
+                )
+
+
+class _Timed:
+    """Times a query for the metrics and the ``query_log`` (``rows`` is set by the caller, if known)"""
+
+    __slots__ = ("operation", "query", "rows", "start")
+
+    def __init__(self, operation: str, query: ClauseElement | str):
+        self.operation = operation
+        self.query = query
+        self.rows: Optional[int] = None
+
+    def __enter__(self) -> _Timed:
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        duration = time.perf_counter() - self.start
+        db_queries.inc((self.operation,))
+        db_query_duration.observe(duration, (self.operation,))
+        if (log := query_log.get()) is not None:
+            log.add(QueryRecord(_fingerprint(self.query), self.operation, duration, self.rows))
+
 
+class InstrumentedDatabase(databases.Database):
+    """``databases.Database`` which counts and times every query (for the metrics and the ``query_log``)"""
 
-database = databases.Database(url := settings.DATABASE.URL.unicode_string())
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> list[Record]:
+        with _Timed("fetch_all", query) as timed:
+            rows = await super().fetch_all(query, values)
+            timed.rows = len(rows)
+            return rows
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Optional[Record]:
+        with _Timed("fetch_one", query) as timed:
+            row = await super().fetch_one(query, values)
+            timed.rows = int(row is not None)
+            return row
+
+    async def fetch_val(self, query: Any, values: Optional[dict] = None, column: Any = 0) -> Any:
+        with _Timed("fetch_val", query) as timed:
+            value = await super().fetch_val(query, values, column)
+            timed.rows = int(value is not None)
+            return value
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        with _Timed("execute", query):
+            return await super().execute(query, values)
+
+    async def execute_many(self, query: Any, values: list) -> None:
+        with _Timed("execute_many", query) as timed:
+            timed.rows = len(values)
+            return await super().execute_many(query, values)
+
+    async def iterate(self, query: Any, values: Optional[dict] = None) -> AsyncGenerator[Mapping, None]:
+        # timed until the last record was fetched (including the time the consumer takes per record)
+        with _Timed("iterate", query) as timed:
+            timed.rows = 0
+            async for record in super().iterate(query, values):
+                timed.rows += 1
+                yield record
+
+
+database = InstrumentedDatabase(url := settings.DATABASE.URL.unicode_string())
 engine = create_engine(url, connect_args={"check_same_thread": False})
 
 
+@lru_cache
+def _compiled_insert(
+    table: Table, keys: tuple[str, ...], on_conflict: str = ""
+) -> tuple[str, tuple[str, ...], list[Callable[[Any], Any]]]:
+    compiled = table.insert().compile(dialect=_dialect, column_keys=list(keys))
+    return (
+        f"{compiled} {on_conflict}".rstrip(),
+        tuple(compiled.positiontup),
+        [table.c[key].type.bind_processor(_dialect) or (lambda value: value) for key in compiled.positiontup],
+    )
+
+
+async def insert_many(model: type[DBBaseModel], rows: Iterable[dict[str, Any]], on_conflict: str = "") -> int:
+    """Inserts every row (all with the same keys) with one ``executemany`` within a transaction
+
+    ``databases`` runs ``execute_many`` as one ``execute`` per row, which is slow for thousands of rows.
+    ``on_conflict`` is appended to the ``INSERT`` as it is (an ``ON CONFLICT ...`` clause, turning it into an upsert).
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    sql, keys, processors = _compiled_insert(model.__table__, tuple(sorted(rows[0])), on_conflict)
+    async with database.connection() as connection:
+        async with connection.transaction():
+            with _Timed("insert_many", sql) as timed:
+                timed.rows = len(rows)
+                await connection.raw_connection.executemany(
+                    sql, [[process(row[key]) for key, process in zip(keys, processors)] for row in rows]
+                )
+    return len(rows)
+
+
+def _add_verification_code_expiry() -> None:
+    """Adds ``created_at``/``expires_at`` to ``verification_code``-tables created before codes expired"""
+    with engine.begin() as connection:
+        columns = {column["name"] for column in inspect(connection).get_columns(VerificationCodesModel.__tablename__)}
+        if "expires_at" in columns:
+            return
+        now = datetime.utcnow()
+        for column in ("created_at", "expires_at"):  # SQLite requires a constant default for new NOT NULL columns
+            connection.execute(
+                text(f"ALTER TABLE verification_code ADD COLUMN {column} DATETIME NOT NULL DEFAULT '{now}'")
+            )
+        # pending codes get the full lifetime from now on
+        connection.execute(
+            VerificationCodesModel.update().values(
+                expires_at=now + timedelta(hours=settings.VERIFICATION.CODE_LIFETIME)
+            )
+        )
+
+
+def _count_unread_messages() -> None:
+    """Fills the (new) ``unread_count``-table of databases which already have messages"""
+    with engine.begin() as connection:
+        connection.execute(
+            UnreadCountModel.insert().from_select(
+                ["user_id", "unread"],
+                select(MessageModel.user_id, func.count())
+                .where(MessageModel.read.is_(False))
+                .group_by(MessageModel.user_id),
+            )
+        )
+
+
+def _deduplicate_rosters() -> None:
+    """Keeps only the latest roster per week, so the unique index can be created on tables from before it"""
+    with engine.begin() as connection:
+        if any(index["name"] == "ux_roster_year_week" for index in inspect(connection).get_indexes("roster")):
+            return
+        latest = select(func.max(RosterModel.roster_id)).group_by(RosterModel.year, RosterModel.week)
+        connection.execute(RosterModel.delete().where(RosterModel.roster_id.not_in(latest)))
+
+
 async def setup() -> None:
     # local
     from .oauth2 import get_password_hash  # circular import
 
+    unread_counted = inspect(engine).has_table(UnreadCountModel.__tablename__)
     DBBaseModel.metadata.create_all(engine)
+    _add_verification_code_expiry()
+    if not unread_counted:
+        _count_unread_messages()
+    _deduplicate_rosters()
+    # ``create_all`` only creates indices together with new tables, so already existing tables are checked as well
+    for table in DBBaseModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
     # should an owner be created?
     if not settings.DATABASE.CREATE_OWNER:
@@ -2,61 +2,431 @@ from __future__ import annotations
 
 
 __all__ = (
+    "EmailRenderer",
+    "email_renderer",
+    "SMTPPool",
+    "smtp_pool",
     "send",
-    "send_verification_email",
+    "EmailOutbox",
+    "email_outbox",
+    "queue_verification_email",
 )
 
 
+# standard library
+import asyncio
+import random
+import sys
+import time
+import traceback
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import formataddr, make_msgid
+from pathlib import Path
+from urllib.parse import urlencode
+
 # third party
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+import aiosmtplib
+from databases.interfaces import Record
+from fastapi_mail import MessageSchema, MessageType
+from sqlalchemy import func, select
 
 # typing
 from pydantic import EmailStr
+from typing import Any, AsyncIterator, Iterable, Optional
 
 # fastapi
-from fastapi import Request
+from jinja2.environment import Environment, Template
+from jinja2.loaders import FileSystemLoader
+from starlette.routing import Router
 
 # local
+from .database import database, insert_many
 from .environment import settings
-from .templates import templates
+from .models import EmailOutboxModel
+from .templates import bytecode_cache
 from .utils import might_raise
 
 
-fastmail = FastMail(
-    ConnectionConfig(
-        MAIL_USERNAME=settings.MAIL.USERNAME,
-        MAIL_PASSWORD=settings.MAIL.PASSWORD.get_secret_value(),
-        MAIL_PORT=settings.MAIL.PORT,
-        MAIL_SERVER=settings.MAIL.SERVER,
-        MAIL_STARTTLS=settings.MAIL.STARTTLS,
-        MAIL_SSL_TLS=settings.MAIL.SSL_TLS,
-        MAIL_DEBUG=settings.ENVIRONMENT == "development",
-        MAIL_FROM=settings.MAIL.FROM,
-        MAIL_FROM_NAME=settings.MAIL.FROM_NAME,
-        SUPPRESS_SEND=settings.MAIL.DISABLED,
-    )
+class EmailRenderer:
+    """Renders the email-templates (``templates/email/``) to strings without any request
+
+    Uses its own environment in which every email-template is compiled once when it's created. URLs are built
+    with ``url_for`` from the routes of the app (see ``bind``) and ``base_url``.
+    """
+
+    def __init__(self, base_url: str, directory: str = "email"):
+        self.base_url = base_url.rstrip("/")
+        self.router: Optional[Router] = None
+        self.env = Environment(
+            loader=FileSystemLoader(["templates", "static"]),
+            autoescape=True,
+            auto_reload=False,  # the templates are compiled once
+            bytecode_cache=bytecode_cache,
+        )
+        exec(Path(__file__).parents[1].joinpath("__init__.py").read_text(), self.env.globals)  # noqa S102
+        self.env.globals.pop("__builtins__")
+        self.env.globals["url_for"] = self.url_for
+        self._templates: dict[str, Template] = {
+            name: self.env.get_template(name)
+            for name in self.env.list_templates(filter_func=lambda name: name.startswith(f"{directory}/"))
+        }
+
+    def bind(self, router: Router) -> None:
+        """Sets the routes ``url_for`` uses (as the app imports this module, it can't be imported here)"""
+        self.router = router
+
+    def url_for(self, name: str, /, **path_params: Any) -> str:
+        if self.router is None:
+            raise RuntimeError("EmailRenderer.bind hasn't been called")
+        return self.base_url + self.router.url_path_for(name, **path_params)
+
+    def render(self, name: str, /, **context: Any) -> str:
+        template = self._templates.get(name) or self.env.get_template(name)
+        return template.render(context)
+
+
+email_renderer = EmailRenderer(settings.BASE_URL.unicode_string())
+
+
+class SMTPPool:
+    """Keeps up to ``size`` authenticated SMTP connections open and reuses them for further emails
+
+    ``size`` is the limit of concurrent connections as well; further senders wait for a free connection. Every
+    connection sends one email after another, so the (TLS-)handshake and login are only done once per connection
+    instead of per email. ``send_many`` splits the emails into (up to ``size``) batches and sends each batch over a
+    single checkout, so the pool is only asked once per batch. Connections idle for longer than ``keep_alive``
+    seconds are closed instead of reused.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str],
+        password: Optional[str],
+        sender: str,
+        *,
+        use_tls: bool = False,
+        start_tls: bool = False,
+        size: int = 4,
+        keep_alive: float = 60,
+        timeout: float = 60,
+        suppress_send: bool = False,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.size = size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.suppress_send = suppress_send
+        self._idle: list[tuple[aiosmtplib.SMTP, float]] = []  # used last first, so the others can time out
+        self._semaphore = asyncio.Semaphore(size)
+        self.sent: int = 0
+        self.failed: int = 0
+        self.connects: int = 0
+        """Amount of opened connections (compare with ``sent``)."""
+
+    def build(self, message: MessageSchema) -> EmailMessage:
+        email = EmailMessage()
+        email["Subject"] = message.subject
+        email["From"] = self.sender
+        email["To"] = ", ".join(message.recipients)
+        email["Message-ID"] = make_msgid()
+        email.set_content(message.body, subtype="html" if message.subtype == MessageType.html else "plain")
+        return email
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+            timeout=self.timeout,
+        )
+        await smtp.connect()
+        if self.username is not None:
+            await smtp.login(self.username, self.password)
+        self.connects += 1
+        return smtp
+
+    @staticmethod
+    async def _close(smtp: aiosmtplib.SMTP) -> None:
+        try:
+            await smtp.quit()
+        except aiosmtplib.SMTPException:
+            smtp.close()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosmtplib.SMTP]:
+        """A connected (and logged in) session; it's closed if anything raises while using it"""
+        async with self._semaphore:
+            smtp = None
+            while self._idle:
+                smtp, last_used = self._idle.pop()
+                if smtp.is_connected and time.monotonic() - last_used < self.keep_alive:
+                    break
+                await self._close(smtp)
+                smtp = None
+            if smtp is None:
+                smtp = await self._connect()
+
+            try:
+                yield smtp
+            except BaseException:
+                await self._close(smtp)
+                raise
+            self._idle.append((smtp, time.monotonic()))
+
+    async def _send_batch(self, emails: list[EmailMessage]) -> list[Optional[Exception]]:
+        """Sends the emails one after another over one connection; ``None`` for every successful one
+
+        Emails refused by the server fail alone (the connection is reset and reused). If the connection is lost, the
+        rest is sent over a new one; a kept connection which was closed by the server is retried once.
+        """
+        results: list[Optional[Exception]] = []
+        retried = False
+        while len(results) < len(emails):
+            connected = False
+            try:
+                async with self.connection() as smtp:
+                    connected = True
+                    for email in emails[len(results) :]:
+                        try:
+                            await smtp.send_message(email)
+                        except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused) as exception:
+                            results.append(exception)
+                        else:
+                            results.append(None)
+                        retried = False
+            except Exception as exception:
+                if not connected:  # the server isn't reachable, the others would fail the same way
+                    results.extend([exception] * (len(emails) - len(results)))
+                elif isinstance(exception, aiosmtplib.SMTPServerDisconnected) and not retried:
+                    retried = True
+                else:
+                    results.append(exception)
+                    retried = False
+        self.sent += results.count(None)
+        self.failed += len(results) - results.count(None)
+        return results
+
+    async def send(self, message: MessageSchema) -> None:
+        if self.suppress_send:
+            return
+        if (exception := (await self._send_batch([self.build(message)]))[0]) is not None:
+            raise exception
+
+    async def send_many(self, messages: Iterable[MessageSchema]) -> list[Optional[Exception]]:
+        """Sends the messages in (up to ``size``) concurrent batches; ``None`` for every successful one"""
+        emails = [self.build(message) for message in messages]
+        if self.suppress_send:
+            return [None] * len(emails)
+        start = time.perf_counter()
+        size, larger = divmod(len(emails), self.size)  # the first ``larger`` batches get one more email
+        bounds = [i * size + min(i, larger) for i in range(self.size + 1)]
+        batches = await asyncio.gather(
+            *(self._send_batch(emails[lower:upper]) for lower, upper in zip(bounds, bounds[1:]) if lower < upper)
+        )
+        results = [result for batch in batches for result in batch]
+        if emails:
+            duration = time.perf_counter() - start
+            succeeded = results.count(None)
+            sys.stdout.write(
+                f"INFO: sent {succeeded}/{len(emails)} email(s) in {duration:.2f}s "
+                f"({succeeded / max(duration, 1e-9):.1f} msg/s, {self.connects} connection(s) opened so far)\n"
+            )
+        return results
+
+    async def close(self) -> None:
+        while self._idle:
+            await self._close(self._idle.pop()[0])
+
+
+smtp_pool = SMTPPool(
+    settings.MAIL.SERVER,
+    settings.MAIL.PORT,
+    settings.MAIL.USERNAME if settings.MAIL.USE_CREDENTIALS else None,
+    settings.MAIL.PASSWORD.get_secret_value() if settings.MAIL.USE_CREDENTIALS else None,
+    formataddr((settings.MAIL.FROM_NAME, settings.MAIL.FROM)),
+    use_tls=settings.MAIL.SSL_TLS,
+    start_tls=settings.MAIL.STARTTLS,
+    size=settings.MAIL.POOL_SIZE,
+    keep_alive=settings.MAIL.KEEP_ALIVE,
+    suppress_send=settings.MAIL.DISABLED,
 )
 
 
 async def send(message: MessageSchema, *, silent: bool = True) -> bool:
-    ok, _ = await might_raise(fastmail.send_message(message), silent)
+    ok, _ = await might_raise(smtp_pool.send(message), silent)
     return ok and not settings.MAIL.DISABLED
 
 
-async def send_verification_email(request: Request, to: EmailStr, code: str) -> bool:
-    return await send(
+class EmailOutbox:
+    """Durable queue of emails (the ``email_outbox``-table) which a background task sends
+
+    Emails are queued with ``queue`` as part of the caller's transaction, so they're only sent if it's committed.
+    Failed attempts are retried with exponential backoff; after ``max_attempts`` the email is kept as ``"dead"``.
+    Due emails are leased before they're sent, so several workers can share the table without sending twice.
+    """
+
+    BATCH = 20  # emails claimed at once
+    LEASE = 300  # seconds a claimed email isn't claimed again (e.g. if the worker crashed while sending it)
+    IDLE = 60  # seconds; the table is checked at least this often (for emails queued by other workers)
+
+    def __init__(self, max_attempts: int = 8, backoff: float = 30):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="email-outbox")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await smtp_pool.close()  # the worker is cancelled while it waits as well, so it can't do it itself
+
+    async def queue(self, message: MessageSchema) -> int:
+        """Stores the message (within the current transaction); call ``notify`` once it's committed"""
+        now = datetime.utcnow()
+        return await database.execute(
+            EmailOutboxModel.insert().values(
+                recipients=",".join(message.recipients),
+                subject=message.subject,
+                body=message.body,
+                subtype=message.subtype.value,
+                status="pending",
+                attempts=0,
+                next_attempt_at=now,
+                created_at=now,
+            )
+        )
+
+    async def queue_many(self, messages: Iterable[MessageSchema]) -> int:
+        """Stores every message with one ``executemany`` (within a transaction); call ``notify`` afterwards"""
+        now = datetime.utcnow()
+        return await insert_many(
+            EmailOutboxModel,
+            (
+                {
+                    "recipients": ",".join(message.recipients),
+                    "subject": message.subject,
+                    "body": message.body,
+                    "subtype": message.subtype.value,
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                    "created_at": now,
+                }
+                for message in messages
+            ),
+        )
+
+    def notify(self) -> None:
+        """Lets the worker send newly queued emails right away"""
+        self._wakeup.set()
+
+    async def _claim(self) -> list[Record]:
+        now = datetime.utcnow()
+        due = (
+            select(EmailOutboxModel.outbox_id)
+            .where(EmailOutboxModel.status == "pending", EmailOutboxModel.next_attempt_at <= now)
+            .order_by(EmailOutboxModel.next_attempt_at)
+            .limit(self.BATCH)
+        )
+        return await database.fetch_all(
+            EmailOutboxModel.update()
+            .where(EmailOutboxModel.outbox_id.in_(due))
+            .values(next_attempt_at=now + timedelta(seconds=self.LEASE))
+            .returning(*EmailOutboxModel.__table__.columns)
+        )
+
+    async def _settle(self, email: Record, exception: Optional[Exception]) -> None:
+        if exception is None:
+            await database.execute(EmailOutboxModel.delete().where(EmailOutboxModel.outbox_id == email.outbox_id))
+            return
+
+        error = f"{type(exception).__name__}: {exception}"
+        attempts = email.attempts + 1
+        if attempts >= self.max_attempts:
+            sys.stderr.write(f"ERROR: email #{email.outbox_id} is dead after {attempts} attempts ({error})\n")
+            values = {"status": "dead"}
+        else:
+            # exponential backoff with jitter, so emails which failed together aren't retried together
+            delay = self.backoff * 2 ** (attempts - 1) * random.uniform(0.75, 1.25)
+            sys.stderr.write(f"WARNING: email #{email.outbox_id} failed, retrying in {delay:.0f}s ({error})\n")
+            values = {"next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)}
+        await database.execute(
+            EmailOutboxModel.update()
+            .where(EmailOutboxModel.outbox_id == email.outbox_id)
+            .values(attempts=attempts, last_error=error, **values)
+        )
+
+    async def _seconds_until_due(self) -> float:
+        next_attempt_at = await database.fetch_val(
+            select(func.min(EmailOutboxModel.next_attempt_at)).where(EmailOutboxModel.status == "pending")
+        )
+        if next_attempt_at is None:
+            return self.IDLE
+        return min(self.IDLE, max(0.0, (next_attempt_at - datetime.utcnow()).total_seconds()))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self._wakeup.clear()
+                emails = await self._claim()
+                results = await smtp_pool.send_many(
+                    MessageSchema(
+                        subject=email.subject,
+                        recipients=email.recipients.split(","),
+                        body=email.body,
+                        subtype=MessageType(email.subtype),
+                    )
+                    for email in emails
+                )
+                for email, exception in zip(emails, results):
+                    await self._settle(email, exception)
+                if len(emails) == self.BATCH:  # there may be more
+                    continue
+                timeout = await self._seconds_until_due()
+            except Exception:  # noqa  # e.g. a locked database; the emails are still in the table
+                sys.stderr.write("Following exception was silenced in the email-outbox\n")
+                sys.stderr.write(traceback.format_exc())  # will get logged
+                timeout = self.IDLE
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+email_outbox = EmailOutbox(settings.MAIL.OUTBOX_MAX_ATTEMPTS, settings.MAIL.OUTBOX_BACKOFF)
+
+
+async def queue_verification_email(to: EmailStr, code: str) -> int:
+    """Queues the email in the email-outbox (so call it within the transaction which created the code)"""
+    return await email_outbox.queue(
         MessageSchema(
             subject="Email Verification",
             recipients=[to],
-            body=templates.TemplateResponse(
-                request,
+            body=email_renderer.render(
                 "email/email-verification.html",
-                {
-                    "code": code,
-                    "url": f"{request.base_url.scheme}://{request.base_url.hostname}:{request.base_url.port}"
-                    f"{request.app.url_path_for('verify')}?email={to}&code={code}",
-                },
-            ).body.decode("utf-8"),
+                code=code,
+                url=f"{email_renderer.url_for('verify')}?{urlencode({'email': to, 'code': code})}",
+            ),
             subtype=MessageType.html,
         ),
     )
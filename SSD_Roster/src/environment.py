@@ -22,6 +22,13 @@ class Database(BaseModel):
     OWNER_USERNAME: str
     OWNER_PASSWORD: SecretStr
     OWNER_EMAIL: EmailStr
+    QUERY_LOG: bool = True  # records the queries per request (for warnings and, in development, "Server-Timing")
+    REPEATED_QUERY_THRESHOLD: int = 10  # warns if the same query runs more often within one request
+
+
+class Verification(BaseModel):
+    CODE_LIFETIME: int = 48  # in hours; afterwards the code and the unverified registration are deleted
+    PURGE_INTERVAL: int = 3600  # in seconds
 
 
 class Token(BaseModel):
@@ -40,6 +47,53 @@ class Mail(BaseModel):
     STARTTLS: bool
     SSL_TLS: bool
     DISABLED: bool
+    USE_CREDENTIALS: bool = True  # false for local servers without authentication (e.g. ``python -m aiosmtpd -n``)
+    POOL_SIZE: int = 4  # concurrent SMTP-connections (kept open to be reused)
+    KEEP_ALIVE: float = 60  # seconds an idle SMTP-connection is kept open
+    OUTBOX_MAX_ATTEMPTS: int = 8  # an email is given up ("dead") after that many failed attempts
+    OUTBOX_BACKOFF: float = 30  # seconds until the first retry, doubled for every further one
+
+
+class Log(BaseModel):
+    LIMIT: int = 1000  # records kept in memory
+    QUEUE_SIZE: int = 10_000  # writes waiting for the background-writer
+    OVERFLOW: Literal["drop-oldest", "drop-newest", "write-through"] = "drop-oldest"
+    SHARED: str = ""  # file of the memory-mapped buffer shared by every worker (an empty string keeps it per process)
+    ARCHIVE: str = "logs.sqlite"  # persistent archive (an empty string disables it)
+    ARCHIVE_MAX_MB: int = 100
+    ARCHIVE_MAX_DAYS: int = 30
+
+
+class Session(BaseModel):
+    BACKEND: Literal["memory", "sqlite"] = "memory"  # "memory" isn't shared between workers
+    MEMORY_SIZE: int = 10_000  # sessions kept by the "memory"-backend
+    SQLITE: str = "sessions.sqlite"  # file of the "sqlite"-backend
+    MAX_AGE: int = 14 * 24  # in hours
+
+
+class Templates(BaseModel):
+    BYTECODE_CACHE: bool = True  # compiled templates are kept on disk, so new workers don't compile them again
+    BYTECODE_CACHE_DIR: str = ""  # an empty string uses a directory in the system's temp-directory
+
+
+class Static(BaseModel):
+    BUILD_DIRECTORY: str = ""  # compressed variants of the static files; an empty string uses the temp-directory
+
+
+class Compression(BaseModel):
+    ENABLED: bool = True  # disable if a reverse proxy compresses the responses
+    MINIMUM_SIZE: int = 1024  # bytes; smaller responses aren't compressed
+
+
+class Metrics(BaseModel):
+    ENABLED: bool = True
+    ALLOWED_HOSTS: list[str] = ["127.0.0.1", "::1"]  # may scrape without a token; everyone else needs "metrics:see"
+
+
+class LoopMonitor(BaseModel):
+    ENABLED: bool = True
+    INTERVAL: float = 0.05  # seconds between two measurements of the event loop's lag
+    THRESHOLD: float = 0.1  # seconds; longer blocks are logged with the stack of the blocking code
 
 
 class Settings(BaseSettings):
@@ -55,12 +109,21 @@ class Settings(BaseSettings):
     TITLE: str
     HOST: str
     PORT: int
+    BASE_URL: Annotated[AnyUrl, UrlConstraints(allowed_schemes=["http", "https"])]  # public URL, e.g. for emails
     ENVIRONMENT: Literal["production", "development"]
     SECRET_KEY: SecretStr  # openssl rand -hex 32
     ALLOW_DEMO_USERS_IN_DEVELOPMENT: bool
     DATABASE: Database
     TOKEN: Token
+    VERIFICATION: Verification = Verification()
     MAIL: Mail
+    LOG: Log = Log()
+    SESSION: Session = Session()
+    TEMPLATES: Templates = Templates()
+    STATIC: Static = Static()
+    COMPRESSION: Compression = Compression()
+    METRICS: Metrics = Metrics()
+    LOOP_MONITOR: LoopMonitor = LoopMonitor()
 
     OVERRIDE_422_WITH_400: bool = True
 
@@ -16,6 +16,7 @@ from starlette.status import HTTP_400_BAD_REQUEST, HTTP_422_UNPROCESSABLE_ENTITY
 
 # local
 from .environment import settings
+from .sessions import load_session
 from .templates import templates
 
 
@@ -26,6 +27,7 @@ if settings.OVERRIDE_422_WITH_400:
 
 async def exception_handler(request: Request, exc: StarletteHTTPException):  # noqa ANN201
     code = exc.status_code
+    await load_session(request)  # for the flashed messages
     return templates.TemplateResponse(
         request,
         "error-page.html",
@@ -41,6 +43,7 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         if settings.OVERRIDE_422_WITH_400
         else (HTTP_422_UNPROCESSABLE_ENTITY, "Unprocessable Entity")
     )
+    await load_session(request)  # for the flashed messages
     return templates.TemplateResponse(
         request,
         "error-page.html",
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "UserIdentityMap",
+    "get_user_identity_map",
+)
+
+
+# standard library
+import sys
+
+# third party
+from databases.interfaces import Record
+
+# typing
+from typing import AsyncIterator, Iterable, Literal, Optional
+
+# fastapi
+from fastapi import Request
+
+# local
+from .database import database
+from .environment import settings
+from .metrics import cache_lookups
+from .models import UserID, UserModel
+
+
+class UserIdentityMap:
+    """Loads every user row at most once (meant to live as long as one request)"""
+
+    def __init__(self):
+        self._by_id: dict[int, Optional[Record]] = {}
+        self._by_column: dict[tuple[str, str], Optional[int]] = {}
+        self.avoided: int = 0
+        """Amount of fetches which were answered from the map instead of the database."""
+
+    def _remember(self, user: Record) -> Record:
+        self._by_id[user.user_id] = user
+        self._by_column[("username", user.username)] = user.user_id
+        self._by_column[("email", user.email)] = user.user_id
+        return user
+
+    async def get(self, user_id: UserID) -> Optional[Record]:
+        if user_id in self._by_id:
+            self.avoided += 1
+            cache_lookups.inc(("user_identity_map", "hit"))
+            return self._by_id[user_id]
+        cache_lookups.inc(("user_identity_map", "miss"))
+        user = await database.fetch_one(UserModel.select().where(UserModel.user_id == user_id))
+        if user is None:
+            self._by_id[user_id] = None
+            return None
+        return self._remember(user)
+
+    async def get_by(self, column: Literal["username", "email"], value: str) -> Optional[Record]:
+        if (key := (column, value)) in self._by_column:
+            self.avoided += 1
+            cache_lookups.inc(("user_identity_map", "hit"))
+            return None if (user_id := self._by_column[key]) is None else self._by_id[user_id]
+        cache_lookups.inc(("user_identity_map", "miss"))
+        user = await database.fetch_one(UserModel.select().where(getattr(UserModel, column) == value))
+        if user is None:
+            self._by_column[key] = None
+            return None
+        return self._remember(user)
+
+    async def get_many(self, user_ids: Iterable[Optional[UserID]]) -> dict[int, Record]:
+        """Every unknown user gets loaded with a single query; users which don't exist are omitted"""
+        user_ids = {user_id for user_id in user_ids if user_id is not None}
+        if missing := user_ids - self._by_id.keys():
+            for user in await database.fetch_all(UserModel.select().where(UserModel.user_id.in_(missing))):
+                self._remember(user)
+            for user_id in missing - self._by_id.keys():
+                self._by_id[user_id] = None
+        self.avoided += len(user_ids) - len(missing)
+        cache_lookups.inc(("user_identity_map", "hit"), len(user_ids) - len(missing))
+        cache_lookups.inc(("user_identity_map", "miss"), len(missing))
+        return {user_id: user for user_id in user_ids if (user := self._by_id[user_id]) is not None}
+
+    async def get_all(self) -> list[Record]:
+        return [self._remember(user) for user in await database.fetch_all(UserModel.select())]
+
+    def invalidate(self, user_id: UserID) -> None:
+        """Has to be called after a user got updated/deleted"""
+        self._by_id.pop(user_id, None)
+        for key in [key for key, value in self._by_column.items() if value == user_id]:
+            del self._by_column[key]
+
+
+async def get_user_identity_map(request: Request) -> AsyncIterator[UserIdentityMap]:
+    # stored on the request as FastAPI caches dependencies per set of security-scopes, not per request
+    if (identity_map := getattr(request.state, "user_identity_map", None)) is not None:
+        yield identity_map
+        return
+
+    request.state.user_identity_map = identity_map = UserIdentityMap()
+    try:
+        yield identity_map
+    finally:
+        if settings.ENVIRONMENT == "development" and identity_map.avoided:
+            sys.stdout.write(
+                f"{request.method} {request.url.path}: avoided {identity_map.avoided} duplicate user fetch(es)\n"
+            )
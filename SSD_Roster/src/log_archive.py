@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+
+__all__ = ("LogArchive",)
+
+
+# standard library
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+# typing
+from typing import Optional
+
+# local
+from .log_store import Level, LEVELS, LogRecord, Source
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS log (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    source TEXT NOT NULL,
+    level TEXT NOT NULL,
+    request_id TEXT,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_log_timestamp ON log (timestamp);
+CREATE INDEX IF NOT EXISTS ix_log_source_timestamp ON log (source, timestamp);
+CREATE INDEX IF NOT EXISTS ix_log_request_id ON log (request_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5 (message, content='log', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS log_ai AFTER INSERT ON log BEGIN
+    INSERT INTO log_fts (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS log_ad AFTER DELETE ON log BEGIN
+    INSERT INTO log_fts (log_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+"""
+
+
+class LogArchive:
+    """Append-only archive of log records in its own SQLite file with a FTS5 index for the messages
+
+    Records are queued and written in batches (one transaction each) by a dedicated thread. The same thread
+    removes the oldest records once they're older than ``max_age_days`` or the file exceeds ``max_bytes``.
+    At most ``max_queue`` records are queued, older ones are dropped (and counted) if the thread falls behind; a
+    batch which can't be written is retried with the next ones ``RETRIES`` times before it's dropped as well.
+    """
+
+    BATCH_INTERVAL = 1  # seconds
+    RETRIES = 3
+    PRUNE_INTERVAL = 600  # seconds
+    PRUNE_BATCH = 5000  # records deleted per transaction, so readers are never locked out for long
+
+    def __init__(self, path: str | Path, max_bytes: int, max_age_days: int, max_queue: int = 100_000):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._queue: deque[LogRecord] = deque(maxlen=max_queue)
+        self._batch: list[LogRecord] = []  # taken from the queue, but not written yet
+        self._failures = 0  # of the current batch
+        self.dropped: int = 0
+        """Amount of records which weren't archived (queue full or batch failed too often)."""
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        connection = self._connect()
+        try:
+            # has to be set before the first table is created, otherwise it's ignored
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("PRAGMA journal_mode = WAL")  # readers don't block the writer (and vice versa)
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+
+        self._thread = threading.Thread(target=self._run, name="log-archive", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def add(self, record: LogRecord) -> None:
+        """Never blocks; the record is written with the next batch (the oldest queued one is dropped if it's full)"""
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(record)
+
+    def _write_batch(self, connection: sqlite3.Connection) -> None:
+        batch = self._batch
+        try:
+            while True:
+                batch.append(self._queue.popleft())
+        except IndexError:
+            pass
+        if not batch:
+            return
+        connection.execute("BEGIN")
+        connection.executemany(
+            "INSERT INTO log (timestamp, source, level, request_id, message) VALUES (?, ?, ?, ?, ?)",
+            [
+                (record.timestamp.timestamp(), record.source, record.level, record.request_id, record.message)
+                for record in batch
+            ],
+        )
+        connection.execute("COMMIT")
+        batch.clear()
+        self._failures = 0
+
+    def _size(self, connection: sqlite3.Connection) -> int:
+        page_size, page_count, freelist_count = (
+            connection.execute(f"PRAGMA {pragma}").fetchone()[0]  # noqa S608
+            for pragma in ("page_size", "page_count", "freelist_count")
+        )
+        return page_size * (page_count - freelist_count)
+
+    def _delete_oldest(self, connection: sqlite3.Connection, where: str = "1", *args: object) -> int:
+        return connection.execute(
+            f"DELETE FROM log WHERE id IN (SELECT id FROM log WHERE {where} ORDER BY id LIMIT ?)",  # noqa S608
+            (*args, self.PRUNE_BATCH),
+        ).rowcount
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        cutoff = time.time() - self.max_age_days * 86400
+        while self._delete_oldest(connection, "timestamp < ?", cutoff) == self.PRUNE_BATCH:
+            pass
+        while self._size(connection) > self.max_bytes and self._delete_oldest(connection):
+            pass
+        connection.execute("PRAGMA incremental_vacuum").fetchall()  # frees one page per step
+
+    def _run(self) -> None:
+        connection = self._connect()
+        next_prune = 0.0
+        try:
+            while not self._closed:
+                self._wakeup.wait(self.BATCH_INTERVAL)
+                try:
+                    self._write_batch(connection)
+                    if time.monotonic() >= next_prune:
+                        self._prune(connection)
+                        next_prune = time.monotonic() + self.PRUNE_INTERVAL
+                except sqlite3.Error as error:  # e.g. locked/full; the batch is retried with the next records
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+                    self._failures += 1
+                    if self._batch and self._failures > self.RETRIES:
+                        self.dropped += len(self._batch)
+                        # the records stay in the memory buffer, they're just missing in the archive
+                        sys.stderr.write(f"ERROR: {len(self._batch)} log record(s) couldn't be archived: {error}\n")
+                        self._batch.clear()
+                        self._failures = 0
+            self._write_batch(connection)
+        finally:
+            connection.close()
+
+    def close(self, timeout: float = 5) -> None:
+        """Writes every queued record and stops the thread"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def search(
+        self,
+        *,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        source: Optional[Source] = None,
+        level: Optional[Level] = None,
+        text: Optional[str] = None,
+        request_id: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> tuple[list[LogRecord], int]:
+        """Like ``LogBuffer.query``, but answered from the indices of the archive (blocking, use a thread)"""
+        where, args = [], []
+        if start is not None:
+            where.append("log.timestamp >= ?")
+            args.append(start.timestamp())
+        if end is not None:
+            where.append("log.timestamp <= ?")
+            args.append(end.timestamp())
+        if source is not None:
+            where.append("log.source = ?")
+            args.append(source)
+        if level is not None:
+            levels = LEVELS[LEVELS.index(level) :]
+            where.append(f"log.level IN ({', '.join('?' * len(levels))})")
+            args.extend(levels)
+        if request_id is not None:
+            where.append("log.request_id = ?")
+            args.append(request_id)
+        if text:
+            where.append("log.id IN (SELECT rowid FROM log_fts WHERE log_fts MATCH ?)")
+            args.append('"' + text.replace('"', '""') + '"')  # as a phrase, so no FTS-syntax is interpreted
+        condition = " AND ".join(where) or "1"
+
+        connection = self._connect()
+        try:
+            total = connection.execute(f"SELECT COUNT(*) FROM log WHERE {condition}", args).fetchone()[0]  # noqa S608
+            rows = connection.execute(
+                "SELECT id, timestamp, source, level, message, request_id FROM log "  # noqa S608
+                f"WHERE {condition} ORDER BY log.timestamp DESC, log.id DESC LIMIT ? OFFSET ?",
+                (*args, limit, offset),
+            ).fetchall()
+        finally:
+            connection.close()
+
+        return [
+            LogRecord(id_, datetime.fromtimestamp(timestamp, timezone.utc), source_, level_, message, request_id_)
+            for id_, timestamp, source_, level_, message, request_id_ in rows
+        ], total
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "Level",
+    "LEVELS",
+    "Source",
+    "LogRecord",
+    "LogSubscription",
+    "LogBuffer",
+    "LogGrouper",
+    "Overflow",
+    "BackgroundWriter",
+)
+
+
+# standard library
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from itertools import count
+
+# typing
+from typing import Callable, get_args, Iterator, Literal, NamedTuple, Optional
+
+
+Level = Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+LEVELS: tuple[Level, ...] = get_args(Level)
+Source = Literal["stdout", "stderr"]
+Overflow = Literal["drop-oldest", "drop-newest", "write-through"]
+
+
+class LogRecord(NamedTuple):
+    seq: int
+    """Continuous number of the record (also used as cursor)."""
+    timestamp: datetime
+    source: Source
+    level: Level
+    message: str
+    request_id: Optional[str]
+
+
+class LogSubscription:
+    """Bounded queue of new records for one subscriber; once full the oldest records are dropped"""
+
+    def __init__(self, maxsize: int):
+        self._queue: deque[LogRecord] = deque(maxlen=maxsize)  # ``append`` is thread-safe and drops the oldest
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self.dropped: int = 0
+        """Amount of records which were dropped as the subscriber was too slow."""
+
+    def push(self, record: LogRecord) -> None:
+        """Called by the writers (from any thread); never blocks"""
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(record)
+        if not self._event.is_set():  # only wake up the subscriber once per batch
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:  # event loop is already closed
+                pass
+
+    async def get(self, timeout: Optional[float] = None) -> list[LogRecord]:
+        """Waits for new records and returns all of them (an empty list if ``timeout`` passed)"""
+        if not self._queue:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._event.clear()
+        records = []
+        while self._queue:
+            records.append(self._queue.popleft())
+        return records
+
+
+class LogBuffer:
+    """Fixed-capacity ring buffer; appending is O(1) and overwrites the oldest record once full"""
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("capacity has to be at least 1")
+        self.capacity = capacity
+        self._records: list[Optional[LogRecord]] = [None] * capacity
+        self._seq = count()  # ``next`` on ``itertools.count`` is atomic, so no lock is needed
+        self._subscriptions: tuple[LogSubscription, ...] = ()  # replaced instead of mutated, so writers need no lock
+
+    def append(self, source: Source, level: Level, message: str, request_id: Optional[str] = None) -> LogRecord:
+        seq = next(self._seq)
+        record = LogRecord(seq, datetime.now(timezone.utc), source, level, message, request_id)
+        self._records[seq % self.capacity] = record
+        for subscription in self._subscriptions:
+            subscription.push(record)
+        return record
+
+    def subscribe(self, maxsize: int = 1000) -> LogSubscription:
+        """Has to be called from within the event loop; don't forget to ``unsubscribe``"""
+        subscription = LogSubscription(maxsize)
+        self._subscriptions = (*self._subscriptions, subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: LogSubscription) -> None:
+        self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+
+    def since(self, seq: int) -> list[LogRecord]:
+        """Every record (oldest first) which is newer than ``seq`` and still in the buffer"""
+        return [record for record in self if record.seq > seq]
+
+    def __len__(self) -> int:
+        return sum(record is not None for record in self._records)
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        """Oldest to newest"""
+        return iter(sorted(filter(None, self._records)))
+
+    def newest_first(self) -> Iterator[LogRecord]:
+        return reversed(list(self))
+
+    def query(
+        self,
+        *,
+        source: Optional[Source] = None,
+        level: Optional[Level] = None,
+        text: Optional[str] = None,
+        request_id: Optional[str] = None,
+        offset: int = 0,
+        limit: int = 100,
+    ) -> tuple[list[LogRecord], int]:
+        """Matching records (newest first) sliced by ``offset``/``limit`` and the total amount of matches"""
+        min_level = LEVELS.index(level) if level is not None else 0
+        text = text.casefold() if text else None
+
+        matches = [
+            record
+            for record in self.newest_first()
+            if (source is None or record.source == source)
+            and LEVELS.index(record.level) >= min_level
+            and (request_id is None or record.request_id == request_id)
+            and (text is None or text in record.message.casefold())
+        ]
+        return matches[offset : offset + limit], len(matches)
+
+
+class LogGrouper:
+    """Collects written fragments into whole lines and groups multi-line tracebacks into one record"""
+
+    _TRACEBACK_HEADER = "Traceback (most recent call last):"
+    _TRACEBACK_CONTINUATIONS = (
+        _TRACEBACK_HEADER,
+        "During handling of the above exception, another exception occurred:",
+        "The above exception was the direct cause of the following exception:",
+    )
+    _MAX_GROUP_LINES = 500  # safety net, a group is flushed anyway once it gets this long
+    _MAX_PENDING = 1 << 16  # same for writes which never contain a linebreak
+
+    def __init__(self, source: Source, emit: Callable[[Source, Level, str, Optional[str]], object]):
+        self.source = source
+        self._emit = emit
+        self._pending = ""
+        self._group: list[str] = []
+        self._request_id: Optional[str] = None  # of the write which started the current line/group
+        self._lock = threading.Lock()
+
+    def _level_of(self, message: str) -> Level:
+        prefix = message.lstrip().split(":", 1)[0]
+        if prefix in LEVELS:
+            return prefix
+        return "INFO" if self.source == "stdout" else "WARNING"
+
+    def _is_traceback_end(self, line: str) -> bool:
+        return bool(line.strip()) and not line[0].isspace() and line.strip() not in self._TRACEBACK_CONTINUATIONS
+
+    def write(self, s: str, request_id: Optional[str] = None) -> None:
+        with self._lock:
+            if not self._pending and not self._group:
+                self._request_id = request_id
+            self._pending += s
+            if "\n" not in self._pending:
+                if len(self._pending) >= self._MAX_PENDING:
+                    self._emit(self.source, self._level_of(self._pending), self._pending, self._request_id)
+                    self._pending = ""
+                return
+            chunk, _, self._pending = self._pending.rpartition("\n")
+
+            if self._group or chunk.startswith(self._TRACEBACK_HEADER):
+                self._group.extend(chunk.split("\n"))
+                last = self._group[-1]
+                if (len(self._group) > 1 and self._is_traceback_end(last)) or len(self._group) >= self._MAX_GROUP_LINES:
+                    self._emit(self.source, "ERROR", "\n".join(self._group), self._request_id)
+                    self._group = []
+            elif chunk:
+                self._emit(self.source, self._level_of(chunk), chunk, self._request_id)
+
+            if not self._group:  # the rest (if any) was written by this write
+                self._request_id = request_id
+
+    def flush(self) -> None:
+        with self._lock:
+            if rest := "\n".join(filter(None, (*self._group, self._pending))):
+                self._emit(self.source, "ERROR" if self._group else self._level_of(rest), rest, self._request_id)
+            self._group, self._pending = [], ""
+
+
+class BackgroundWriter:
+    """Hands writes to a queue which a dedicated thread drains in batches, so writers never wait for the stream
+
+    The thread writes every batch to the original stream and passes it to the ``LogGrouper`` afterwards.
+    Once ``maxsize`` writes are queued, ``overflow`` decides what happens:
+
+    - ``"drop-oldest"``: the oldest queued write is dropped
+    - ``"drop-newest"``: the new write is dropped
+    - ``"write-through"``: the queue is drained and the new write is written synchronously by the writer itself
+      (nothing gets lost and the order is kept, but the writer waits)
+    """
+
+    def __init__(
+        self,
+        write: Callable[[str], object],
+        flush: Callable[[], object],
+        grouper: LogGrouper,
+        maxsize: int = 10_000,
+        overflow: Overflow = "drop-oldest",
+    ):
+        if maxsize < 1:
+            raise ValueError("maxsize has to be at least 1")
+        self._write = write
+        self._flush = flush
+        self._grouper = grouper
+        self.maxsize = maxsize
+        self.overflow: Overflow = overflow
+        # ``deque.append``/``popleft`` are atomic, so neither writers nor the thread need a lock
+        self._queue: deque[tuple[str, Optional[str]]] = deque(maxlen=maxsize if overflow == "drop-oldest" else None)
+        self._wakeup = threading.Event()
+        self._draining = threading.Lock()  # held while writing, so batches (and write-throughs) keep their order
+        self._closed = False
+        self.dropped: int = 0
+        """Amount of writes which got dropped because the queue was full."""
+        self._thread = threading.Thread(target=self._run, name=f"log-writer-{grouper.source}", daemon=True)
+        self._thread.start()
+
+    def put(self, s: str, request_id: Optional[str] = None) -> None:
+        if len(self._queue) >= self.maxsize:
+            if self.overflow == "write-through":
+                with self._draining:
+                    self._drain_queued()  # the earlier writes first
+                    self._write(s)
+                    self._grouper.write(s, request_id)
+                return
+            self.dropped += 1
+            if self.overflow == "drop-newest":
+                return
+        self._queue.append((s, request_id))
+        if not self._wakeup.is_set():
+            self._wakeup.set()
+
+    def _drain(self) -> None:
+        with self._draining:
+            self._drain_queued()
+
+    def _drain_queued(self) -> None:
+        batch = []
+        try:
+            while True:
+                batch.append(self._queue.popleft())
+        except IndexError:
+            pass
+        if not batch:
+            return
+        try:
+            self._write("".join(s for s, _ in batch))
+            self._flush()
+        except (OSError, ValueError):  # e.g. a closed pipe; the records are kept anyway
+            pass
+        for s, request_id in batch:
+            self._grouper.write(s, request_id)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self._drain()
+
+    def close(self, timeout: float = 1) -> None:
+        """Writes everything which is still queued and stops the thread"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._drain()
+        self._grouper.flush()
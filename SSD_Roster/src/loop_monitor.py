@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "LoopLagMonitor",
+    "loop_monitor",
+)
+
+
+# standard library
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+# typing
+from typing import Optional
+
+# local
+from .environment import settings
+from .metrics import event_loop_blocked, event_loop_lag
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up and captures the stack of whatever blocks it
+
+    A task sleeps for ``interval`` and observes how much later than that it's woken up (the lag). A helper thread
+    checks whether the task's last heartbeat is older than ``threshold``; if so, the loop is blocked right now and
+    the thread captures the loop's stack (the blocking code itself). Once the loop runs again, the lag and the stack
+    are logged as a warning, so every synchronous call which takes too long ends up in the logs and the metrics.
+    """
+
+    STACK_LIMIT = 20  # innermost frames of a captured stack
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread: int = 0
+        self._beat: float = 0  # ``time.perf_counter`` of the last heartbeat
+        self._stack: Optional[str] = None  # of the current block (captured by the helper thread)
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stack = None
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join()  # wakes up within ``interval``
+            self._thread = None
+
+    async def _run(self) -> None:
+        while True:
+            self._beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - self._beat - self.interval)
+            event_loop_lag.observe(lag)
+            if lag < self.threshold:
+                continue
+            event_loop_blocked.inc()
+            stack, self._stack = self._stack, None
+            sys.stderr.write(
+                f"WARNING: the event loop was blocked for {lag:.3f}s"
+                + (f", blocking call:\n{stack}\n" if stack else " (the blocking code wasn't caught)\n")
+            )
+
+    def _watch(self) -> None:
+        captured = 0.0  # heartbeat whose block was captured already
+        while not self._stopped.wait(self.interval / 2):
+            beat = self._beat
+            if beat == captured or time.perf_counter() - beat < self.threshold + self.interval:
+                continue
+            if (frame := sys._current_frames().get(self._loop_thread)) is None:  # noqa
+                continue
+            summary = traceback.StackSummary.extract(traceback.walk_stack(frame), limit=self.STACK_LIMIT)
+            summary.reverse()
+            if self._beat == beat:  # still the same block (otherwise the stack is of code which runs fine)
+                self._stack = "".join(summary.format()).rstrip()
+                captured = beat
+
+
+loop_monitor = LoopLagMonitor(settings.LOOP_MONITOR.INTERVAL, settings.LOOP_MONITOR.THRESHOLD)
+"""Has to be started (within the event loop) and stopped by the app's lifespan."""
@@ -4,18 +4,29 @@ from __future__ import annotations
 __all__ = (
     "flash",
     "get_flashed_messages",
+    "add_message_for",
+    "add_messages",
     "get_messages_for",
+    "get_unread_count",
 )
 
 
+# standard library
+from collections import Counter
+from datetime import datetime, timezone
+
+# third party
+from sqlalchemy import and_, ColumnElement, func, select
+
 # typing
-from typing import TypedDict
+from typing import Iterable, TypedDict
 
 # fastapi
 from fastapi import Request
 
 # local
-from .models import MessageCategory, MessageSchema, UserID
+from .database import database, insert_many
+from .models import MessageCategory, MessageModel, MessageSchema, UnreadCountModel, UserID
 
 
 class _MessageDict(TypedDict):
@@ -32,23 +43,91 @@ def get_flashed_messages(request: Request, category: MessageCategory | str = "*"
     if category != "*":
         category = MessageCategory(category)
 
+    if not (messages := request.session.get("_messages")):  # don't touch the session if there's nothing to do
+        return []
+
     to_return = []
     to_keep = []
-    for message in request.session.pop("_messages", []):
+    for message in messages:
         if category in ("*", message["ctg"]):
             to_return.append(message)
         else:
             to_keep.append(message)
 
-    request.session["_messages"] = to_keep
+    if to_keep:
+        request.session["_messages"] = to_keep
+    else:
+        del request.session["_messages"]
     return to_return
 
 
-# ToDo: add_message_for(UserID, MessageSchema); just save the message to the database
-
-
-async def get_messages_for(user_id: UserID) -> list[MessageSchema]:
-    # ToDo: do something with the database... idk
-    # ToDo: maybe add more parameters to specify whether the messages should be deleted after retrieval or should be
-    #       preserved for an upcoming request
-    return []
+def _unread_of(user_id: UserID) -> ColumnElement[bool]:
+    return and_(MessageModel.user_id == user_id, MessageModel.read.is_(False))
+
+
+async def add_message_for(user_ids: UserID | Iterable[UserID], message: MessageSchema) -> int:
+    """Stores the message for every user with one ``executemany``; returns the amount of stored messages"""
+    if isinstance(user_ids, int):
+        user_ids = (user_ids,)
+    return await add_messages((user_id, message) for user_id in user_ids)
+
+
+async def add_messages(messages: Iterable[tuple[UserID, MessageSchema]]) -> int:
+    """Stores individual messages for (several) users with one ``executemany``; returns the amount of them"""
+    messages = list(messages)
+    if not messages:
+        return 0
+
+    created_at = datetime.now(timezone.utc).replace(tzinfo=None)  # stored naive (in UTC), as the others
+    async with database.transaction():  # the counters are never out of sync with the messages
+        await insert_many(
+            MessageModel,
+            (
+                {
+                    "user_id": user_id,
+                    "message": message.message,
+                    "category": message.category,
+                    "read": False,
+                    "created_at": created_at,
+                }
+                for user_id, message in messages
+            ),
+        )
+        await insert_many(
+            UnreadCountModel,
+            (
+                {"user_id": user_id, "unread": count}
+                for user_id, count in Counter(user_id for user_id, _ in messages).items()
+            ),
+            on_conflict="ON CONFLICT (user_id) DO UPDATE SET unread = unread + excluded.unread",
+        )
+    return len(messages)
+
+
+async def get_unread_count(user_id: UserID) -> int:
+    """O(1): one lookup of the user's counter by its primary key"""
+    return await database.fetch_val(select(UnreadCountModel.unread).where(UnreadCountModel.user_id == user_id)) or 0
+
+
+async def get_messages_for(user_id: UserID, mark_read: bool = True) -> list[MessageSchema]:
+    """Unread messages of the user (oldest first); ``mark_read`` marks them as read within the same query"""
+    if mark_read:
+        async with database.transaction():
+            rows = await database.fetch_all(
+                MessageModel.update()
+                .where(_unread_of(user_id))
+                .values(read=True)
+                .returning(MessageModel.message, MessageModel.category, MessageModel.created_at)
+            )
+            if rows:  # decremented by what got marked as read here (not reset, messages may have arrived meanwhile)
+                await database.execute(
+                    UnreadCountModel.update()
+                    .where(UnreadCountModel.user_id == user_id)
+                    .values(unread=func.max(UnreadCountModel.unread - len(rows), 0))
+                )
+    else:
+        rows = await database.fetch_all(
+            select(MessageModel.message, MessageModel.category, MessageModel.created_at).where(_unread_of(user_id))
+        )
+    rows = sorted(rows, key=lambda row: row.created_at)  # ``RETURNING`` isn't ordered
+    return [MessageModel.to_schema(row) for row in rows]
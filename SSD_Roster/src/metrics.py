@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "registry",
+    "MetricsMiddleware",
+    # the metrics of the app
+    "http_requests",
+    "http_request_duration",
+    "http_requests_in_flight",
+    "db_queries",
+    "db_query_duration",
+    "cache_lookups",
+    "event_loop_lag",
+    "event_loop_blocked",
+)
+
+
+# standard library
+import time
+from bisect import bisect_left
+from itertools import accumulate
+
+# typing
+from typing import Iterable, Iterator, Optional
+
+# fastapi
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class _Metric:
+    kind: str
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def expose(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(_Metric):
+    """Monotonically increasing values per set of label values (passed positionally, as tuple)"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, labels: tuple[str, ...] = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: tuple[str, ...] = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set_value(self, value: float, labels: tuple[str, ...] = ()) -> None:
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """Counts observations per bucket; only the bucket an observation falls into is touched (cumulated on export)"""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labels: Iterable[str] = (), buckets: tuple[float, ...] = _DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], list[float]] = {}  # per bucket (and +Inf) a count, then the sum
+
+    def observe(self, value: float, labels: tuple[str, ...] = ()) -> None:
+        if (series := self._series.get(labels)) is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        bounds = (*map(_number, self.buckets), "+Inf")
+        for labels, series in sorted(self._series.items()):
+            counts = list(accumulate(series[:-1]))
+            for bound, count in zip(bounds, counts):
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {count}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {counts[-1]}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        """Everything in the Prometheus text-format (version 0.0.4)"""
+        return "\n".join(line for metric in self._metrics.values() for line in metric.expose()) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.register(
+    Counter("ssd_http_requests_total", "Handled HTTP requests.", ("method", "route", "status"))
+)
+http_request_duration = registry.register(
+    Histogram("ssd_http_request_duration_seconds", "Duration of HTTP requests.", ("method", "route"))
+)
+http_requests_in_flight = registry.register(
+    Gauge("ssd_http_requests_in_flight", "HTTP requests which are currently handled.")
+)
+db_queries = registry.register(Counter("ssd_db_queries_total", "Executed database queries.", ("operation",)))
+db_query_duration = registry.register(
+    Histogram(
+        "ssd_db_query_duration_seconds",
+        "Duration of database queries (including the wait for the connection).",
+        ("operation",),
+        (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+    )
+)
+cache_lookups = registry.register(
+    Counter("ssd_cache_lookups_total", "Lookups of in-process caches (by result: hit or miss).", ("cache", "result"))
+)
+event_loop_lag = registry.register(
+    Histogram(
+        "ssd_event_loop_lag_seconds",
+        "How much later than scheduled the event loop ran a callback.",
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+    )
+)
+event_loop_blocked = registry.register(
+    Counter("ssd_event_loop_blocked_total", "Times the event loop was blocked for longer than the threshold.")
+)
+
+
+class MetricsMiddleware:
+    """Counts and times every HTTP request by its route (the path template, so the amount of series is bounded)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status: Optional[int] = None
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            # the router stores the matched route in the scope
+            if (route := scope.get("route")) is not None:
+                name = route.path_format
+            elif scope.get("root_path", "").endswith("/static") or scope["path"].startswith("/static/"):
+                name = "/static"
+            else:
+                name = "<unmatched>"
+            method = scope["method"]
+            http_requests.inc((method, name, str(status or 500)))
+            http_request_duration.observe(duration, (method, name))
@@ -7,6 +7,8 @@ __all__ = (
     "PageID",
     "Year",
     "Week",
+    "IsoWeek",
+    "UserMatrix",
     # enums
     "Availability",
     "Weekday",
@@ -22,17 +24,24 @@ __all__ = (
     "ResponseSchema",
     "RosterResponseSchema",
     "TimetableResponseSchema",
+    "TimetableRangeResponseSchema",
     "LoginResponseSchema",
     "MessagesResponseSchema",
     "MinimalUserSchema",
     "UserResponseSchema",
     "UsersResponseSchema",
+    "QueuedUserSchema",
+    "VerificationQueueResponseSchema",
+    "QueueDecisionResponseSchema",
     # models
     "UserModel",
     "RosterModel",
     "TimetableModel",
     "ScopeModel",
     "VerificationCodesModel",
+    "MessageModel",
+    "UnreadCountModel",
+    "EmailOutboxModel",
 )
 
 
@@ -41,13 +50,14 @@ from datetime import datetime
 
 # third party
 from aenum import IntEnum, StrEnum, Unique
+from sqlalchemy import Index
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column as mc
 from sqlalchemy.sql.sqltypes import Boolean, Date, DateTime, Integer, Text
 
 # typing
 import annotated_types
-from pydantic import BaseModel, EmailStr, Field, FutureDatetime, PastDate, SecretStr
+from pydantic import BaseModel, EmailStr, Field, FutureDatetime, PastDate, SecretStr, StringConstraints
 from typing import Annotated, Literal, Optional, TypeVar
 
 # local
@@ -66,6 +76,25 @@ PageID = Annotated[int, annotated_types.Ge(0)]  # for pagination (e.g. at /timet
 Year = Annotated[int, annotated_types.Ge(datetime.min.year), annotated_types.Le(datetime.max.year)]
 Week = Annotated[int, annotated_types.Ge(1), annotated_types.Le(53)]
 # some years have 53 weeks instead of 52, so they'll be included
+IsoWeek = Annotated[str, StringConstraints(pattern=r"^\d{4}-W\d{2}$")]  # e.g. "2024-W07" (see ISO 8601)
+
+UserMatrix = Annotated[
+    list[
+        Annotated[
+            list[
+                Annotated[
+                    list[Optional[UserID]],
+                    annotated_types.MinLen(3),
+                    annotated_types.MaxLen(3),
+                ]
+            ],
+            annotated_types.MinLen(4),
+            annotated_types.MaxLen(4),
+        ]
+    ],
+    annotated_types.MinLen(5),
+    annotated_types.MaxLen(5),
+]  # 5[days]*4[shifts]*3[users] (see ``RosterSchema``)
 
 
 # ---------- ENUMS ---------- #
@@ -115,6 +144,10 @@ class Scope(StrEnum, settings=Unique, init="value __doc__"):
     # logs
     SEE_LOGS = "logs:see", "See logs."
 
+    # metrics
+    SEE_METRICS = "metrics:see", "See the metrics of the server."
+    PROFILE_SERVER = "metrics:profile", "Profile the server (with a sampling profiler)."
+
     @staticmethod
     def to_oauth2_scopes_dict() -> dict[str, str]:
         return {scope.value: scope.__doc__ for scope in Scope}  # type: ignore
@@ -205,23 +238,7 @@ class MessageCategory(StrEnum, settings=Unique):
 
 
 class RosterSchema(BaseModel):
-    user_matrix: Annotated[
-        list[
-            Annotated[
-                list[
-                    Annotated[
-                        list[Optional[UserID]],
-                        annotated_types.MinLen(3),
-                        annotated_types.MaxLen(3),
-                    ]
-                ],
-                annotated_types.MinLen(4),
-                annotated_types.MaxLen(4),
-            ]
-        ],
-        annotated_types.MinLen(5),
-        annotated_types.MaxLen(5),
-    ] = [
+    user_matrix: UserMatrix = [
         [[None, None, None], [None, None, None], [None, None, None], [None, None, None]],
         [[None, None, None], [None, None, None], [None, None, None], [None, None, None]],
         [[None, None, None], [None, None, None], [None, None, None], [None, None, None]],
@@ -427,6 +444,17 @@ class TimetableResponseSchema(ResponseSchema):
     timetable: TimetableSchema
 
 
+class TimetableRangeResponseSchema(ResponseSchema):
+    user_id: UserID
+    count: Annotated[int, annotated_types.Ge(0)]
+    weeks: list[tuple[Year, Week]]
+    missing: list[tuple[Year, Week]]
+    """Weeks without a stored timetable (they're filled with the default matrix)"""
+    timetables: list[TimetableSchema]
+    compact: list[Annotated[str, annotated_types.MinLen(20), annotated_types.MaxLen(20)]]
+    """One string per week (same order as ``weeks``) with the digit at index ``day*4+slot`` being the availability"""
+
+
 class LoginResponseSchema(ResponseSchema):
     user: UserSchema = Field(exclude=True)
     user_id: UserID
@@ -491,6 +519,22 @@ class UsersResponseSchema(ResponseSchema):
     users: list[MinimalUserSchema]
 
 
+class QueuedUserSchema(MinimalUserSchema):
+    email_verified: bool
+    code_expires_at: Optional[datetime]  # ``None`` once the email is verified
+
+
+class VerificationQueueResponseSchema(UsersResponseSchema):
+    users: list[QueuedUserSchema]
+    total: Annotated[int, annotated_types.Ge(0)]
+    page: PageID
+    per_page: Annotated[int, annotated_types.Ge(1)]
+
+
+class QueueDecisionResponseSchema(ResponseSchema):
+    user_ids: list[UserID]  # the ones which were (still) in the queue
+
+
 # ---------- MODELS ---------- #
 _optional_integer_column = Annotated[Optional[_T], mc(Integer, nullable=True)]
 _integer_column = Annotated[_T, mc(Integer, nullable=False)]
@@ -529,6 +573,8 @@ class UserModel(DBBaseModel):
 
 class RosterModel(DBBaseModel):
     __tablename__ = "roster"
+    # one roster per week, so concurrent publications of a new week can't both insert it
+    __table_args__ = (Index("ux_roster_year_week", "year", "week", unique=True),)
 
     roster_id: Mapped[int] = mc(Integer, primary_key=True, unique=True, autoincrement=True, nullable=False)
     year: Mapped[_integer_column[Year]]
@@ -640,6 +686,7 @@ class RosterModel(DBBaseModel):
 
 class TimetableModel(DBBaseModel):
     __tablename__ = "timetable"
+    __table_args__ = (Index("ix_timetable_user_id_year_week", "user_id", "year", "week", unique=True),)
 
     timetable_id: Mapped[int] = mc(Integer, primary_key=True, unique=True, autoincrement=True, nullable=False)
     user_id: Mapped[_integer_column[UserID]]
@@ -690,7 +737,53 @@ class ScopeModel(DBBaseModel):
 
 class VerificationCodesModel(DBBaseModel):
     __tablename__ = "verification_code"
+    # codes are looked up by their user (the primary key); this one lets the purge find the expired ones
+    __table_args__ = (Index("ix_verification_code_expires_at", "expires_at"),)
 
     user_id: Mapped[int] = mc(Integer, primary_key=True, unique=True, autoincrement=False, nullable=False)
     email: Mapped[_text_column[str]]
     code: Mapped[_text_column[str]]
+    created_at: Mapped[datetime] = mc(DateTime, nullable=False)
+    expires_at: Mapped[datetime] = mc(DateTime, nullable=False)
+
+
+class MessageModel(DBBaseModel):
+    __tablename__ = "message"
+    # covers fetching the (unread) messages of a user in order
+    __table_args__ = (Index("ix_message_user_id_read_created_at", "user_id", "read", "created_at"),)
+
+    message_id: Mapped[int] = mc(Integer, primary_key=True, unique=True, autoincrement=True, nullable=False)
+    user_id: Mapped[_integer_column[UserID]]
+    message: Mapped[_text_column[str]]
+    category: Mapped[_text_column[MessageCategory]]
+    read: Mapped[_boolean_column]
+    created_at: Mapped[datetime] = mc(DateTime, nullable=False)
+
+    @staticmethod  # SQLAlchemy tries to find a column...
+    def to_schema(self: MessageModel) -> MessageSchema:
+        return MessageSchema(message=self.message, category=self.category)
+
+
+class UnreadCountModel(DBBaseModel):
+    __tablename__ = "unread_count"
+
+    # updated within the transactions which add or read messages, so counting is one lookup by the primary key
+    user_id: Mapped[int] = mc(Integer, primary_key=True, unique=True, autoincrement=False, nullable=False)
+    unread: Mapped[_integer_column[int]]
+
+
+class EmailOutboxModel(DBBaseModel):
+    __tablename__ = "email_outbox"
+    # the worker looks for due emails of a status
+    __table_args__ = (Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),)
+
+    outbox_id: Mapped[int] = mc(Integer, primary_key=True, unique=True, autoincrement=True, nullable=False)
+    recipients: Mapped[_text_column[str]]  # comma-separated
+    subject: Mapped[_text_column[str]]
+    body: Mapped[_text_column[str]]
+    subtype: Mapped[_text_column[str]]  # "html" or "plain"
+    status: Mapped[_text_column[Literal["pending", "dead"]]]  # sent ones are deleted
+    attempts: Mapped[_integer_column[int]]
+    next_attempt_at: Mapped[datetime] = mc(DateTime, nullable=False)
+    created_at: Mapped[datetime] = mc(DateTime, nullable=False)
+    last_error: Mapped[_optional_text_column[str]]
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "Audience",
+    "FanOutStats",
+    "RosterNotifier",
+    "roster_notifier",
+)
+
+
+# standard library
+import asyncio
+import sys
+import time
+import traceback
+from collections import defaultdict
+from itertools import islice
+
+# third party
+from fastapi_mail import MessageSchema as EmailSchema
+from fastapi_mail import MessageType
+from sqlalchemy import select
+
+# typing
+from typing import Iterable, Iterator, Literal, NamedTuple, Optional
+
+# local
+from .database import database
+from .email import email_outbox, email_renderer
+from .messages import add_messages
+from .models import GroupedScope, MessageCategory, MessageSchema, RosterSchema, Scope, UserID, UserModel, Weekday
+
+
+Audience = Literal["none", "assigned", "everyone"]
+"""``"everyone"`` are the assigned users and every other user who may see the roster."""
+
+SHIFTS = ("1./2.", "3./4.", "5./6.", "break")
+
+
+class FanOutStats(NamedTuple):
+    year: int
+    week: int
+    recipients: int
+    assigned: int
+    messages: int
+    emails: int
+    duration: float  # seconds
+
+
+def _scopes_of(scopes: str) -> set[str]:
+    """The user's scopes with the groups broken down (as ``get_current_user`` does)"""
+    granted = set()
+    for scope in scopes.split():
+        granted.update((scope,) if ":" in scope else getattr(GroupedScope, scope).split())
+    return granted
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _assignments(roster: RosterSchema) -> dict[UserID, list[tuple[int, int]]]:
+    """Every assigned user with their ``(day, shift)``-slots, from a single pass over the matrix"""
+    slots = defaultdict(list)
+    for day, shifts in enumerate(roster.user_matrix):
+        for shift, user_ids in enumerate(shifts):
+            for user_id in user_ids:
+                if user_id is not None and (day, shift) not in slots[user_id]:
+                    slots[user_id].append((day, shift))
+    return dict(slots)
+
+
+def _describe(slots: list[tuple[int, int]]) -> str:
+    return ", ".join(f"{Weekday(day).name.title()} {SHIFTS[shift]}" for day, shift in slots)
+
+
+class RosterNotifier:
+    """Fans the publication of a roster out to the inboxes (and optionally the email-outbox) of its users
+
+    Recipients are resolved with one query, inbox messages are inserted in chunks of ``CHUNK`` (one ``executemany``
+    each) and the emails are queued in one transaction; the outbox sends them with the bounded concurrency of the
+    SMTP-pool. Every fan-out runs as its own task, so publishing doesn't wait for it.
+    """
+
+    CHUNK = 500  # rows per ``executemany``
+    STOP_TIMEOUT = 10  # seconds pending fan-outs get to finish on shutdown
+
+    def __init__(self):
+        self._tasks: set[asyncio.Task] = set()
+        self.last: Optional[FanOutStats] = None
+        """Stats of the most recently completed fan-out."""
+
+    def submit(self, roster: RosterSchema, audience: Audience = "assigned", email: bool = True) -> None:
+        if audience == "none":
+            return
+        year, week = roster.date_anchor
+        task = asyncio.create_task(self._run(roster, audience, email), name=f"roster-notifier-{year}-{week}")
+        self._tasks.add(task)  # keeps a reference, otherwise the task might be garbage-collected while running
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self) -> None:
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(tuple(self._tasks), timeout=self.STOP_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _run(self, roster: RosterSchema, audience: Audience, email: bool) -> None:
+        try:
+            self.last = stats = await self.fan_out(roster, audience, email)
+        except Exception:  # noqa
+            sys.stderr.write("ERROR: roster notification failed\n")
+            sys.stderr.write(traceback.format_exc())  # will get logged
+            return
+        sys.stdout.write(
+            f"INFO: notified {stats.recipients} user(s) about roster {stats.year}-W{stats.week:02} "
+            f"({stats.assigned} assigned, {stats.messages} message(s), {stats.emails} email(s)) "
+            f"in {stats.duration:.3f}s\n"
+        )
+
+    async def fan_out(self, roster: RosterSchema, audience: Audience, email: bool = True) -> FanOutStats:
+        start = time.perf_counter()
+        year, week = roster.date_anchor
+        slots = _assignments(roster)
+
+        query = select(UserModel.user_id, UserModel.email, UserModel.email_verified, UserModel.scopes).where(
+            UserModel.user_verified.is_(True)
+        )
+        if audience == "assigned":
+            query = query.where(UserModel.user_id.in_(slots))
+        recipients = [
+            user
+            for user in await database.fetch_all(query)
+            if user.user_id in slots or str(Scope.SEE_ROSTER) in _scopes_of(user.scopes)
+        ]
+        assigned = sum(user.user_id in slots for user in recipients)
+
+        # inbox; the assigned users get their own slots, so their messages differ
+        title = f"The roster for week {week} of {year} has been published"
+        general = MessageSchema(message=f"{title}.")
+        messages = 0
+        for chunk in _chunks(
+            (
+                (
+                    user.user_id,
+                    (
+                        MessageSchema(
+                            message=f"{title}, you're assigned to: {_describe(slots[user.user_id])}.",
+                            category=MessageCategory.SUCCESS,
+                        )
+                        if user.user_id in slots
+                        else general
+                    ),
+                )
+                for user in recipients
+            ),
+            self.CHUNK,
+        ):
+            messages += await add_messages(chunk)
+
+        # emails; only queued here, the outbox sends them
+        emails = 0
+        if email:
+            url = email_renderer.url_for("see_roster", year=year, week=week)
+            async with database.transaction():
+                for chunk in _chunks((user for user in recipients if user.email_verified), self.CHUNK):
+                    emails += await email_outbox.queue_many(
+                        EmailSchema(
+                            subject=f"Roster {year}-W{week:02}",
+                            recipients=[user.email],
+                            body=email_renderer.render(
+                                "email/roster-published.html",
+                                year=year,
+                                week=week,
+                                slots=_describe(slots[user.user_id]) if user.user_id in slots else None,
+                                url=url,
+                            ),
+                            subtype=MessageType.html,
+                        )
+                        for user in chunk
+                    )
+            if emails:
+                email_outbox.notify()
+
+        return FanOutStats(year, week, len(recipients), assigned, messages, emails, time.perf_counter() - start)
+
+
+roster_notifier = RosterNotifier()
@@ -31,8 +31,8 @@ from fastapi.security import (
 )
 
 # local
-from .database import database
 from .environment import settings
+from .identity_map import get_user_identity_map, UserIdentityMap
 from .models import GroupedScope, Scope, TokenSchema, UserModel, UserSchema
 
 
@@ -45,6 +45,11 @@ oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl="token",
     scopes=Scope.to_oauth2_scopes_dict(),
 )
+optional_oauth2_scheme = OAuth2PasswordBearer(
+    tokenUrl="token",
+    scopes=Scope.to_oauth2_scopes_dict(),
+    auto_error=False,  # ``None`` without an ``Authorization``-header, e.g. if the token is sent as cookie instead
+)
 
 
 def verify_password(
@@ -69,8 +74,9 @@ def get_password_hash(
 async def authenticate_user(
     username: str,
     password: str | SecretStr,
+    users: Optional[UserIdentityMap] = None,
 ) -> UserSchema | Literal[False]:
-    user: UserModel | None = await database.fetch_one(UserModel.select().where(UserModel.username == username))
+    user: UserModel | None = await (users or UserIdentityMap()).get_by("username", username)
     if user is None or user.email_verified is False or user.password is None or user.user_verified is False:
         # can't be authenticated if A user doesn't exist or B the account hasn't finished every verification step
         return False
@@ -102,6 +108,7 @@ def create_access_token(
 
 async def get_current_user(
     security_scopes: SecurityScopes,
+    users: Annotated[UserIdentityMap, Depends(get_user_identity_map)],
     token: Annotated[str, Depends(oauth2_scheme), Cookie()] = "PUBLIC",
 ) -> UserSchema | None:
     if security_scopes.scopes:
@@ -138,7 +145,7 @@ async def get_current_user(
         except (PyJWTError, ValidationError):
             raise credentials_exception  # noqa R100
 
-        user = await database.fetch_one(UserModel.select().where(UserModel.user_id == token_data.user_id))
+        user = await users.get(token_data.user_id)
         if user is None:
             raise credentials_exception
         user = UserModel.to_schema(user)
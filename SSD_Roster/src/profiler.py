@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "Frame",
+    "SamplingProfiler",
+)
+
+
+# standard library
+import marshal
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+
+# typing
+from typing import Optional
+
+
+Frame = tuple[str, int, str]
+"""``(filename, first line, function)``, just as ``pstats`` identifies functions."""
+
+
+class SamplingProfiler:
+    """Samples the stacks of every thread (the event loop's one included) every ``interval`` seconds
+
+    Nothing is hooked into the interpreter, the sampled threads only pay for holding the GIL while their frames are
+    walked, so it's cheap enough for production. Awaiting coroutines aren't on any stack; the event loop's thread
+    shows the coroutine which is currently running (or ``select`` while it's idle).
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter[tuple[str, tuple[Frame, ...]]] = Counter()  # (thread, frames from the root): samples
+        self._frames: dict[CodeType, Frame] = {}
+        self._threads: dict[int, str] = {}
+
+    def _frame(self, code: CodeType) -> Frame:
+        if (frame := self._frames.get(code)) is None:
+            frame = self._frames[code] = (code.co_filename, code.co_firstlineno, code.co_qualname)
+        return frame
+
+    def _thread(self, ident: int) -> str:
+        if ident not in self._threads:
+            self._threads.update((thread.ident, thread.name) for thread in threading.enumerate())
+        return self._threads.get(ident, f"thread-{ident}")
+
+    def _sample(self, own: int) -> None:
+        for ident, frame in sys._current_frames().items():  # noqa
+            if ident == own:
+                continue
+            stack = []
+            current: Optional[FrameType] = frame
+            while current is not None:
+                stack.append(self._frame(current.f_code))
+                current = current.f_back
+            self.stacks[(self._thread(ident), tuple(reversed(stack)))] += 1
+        self.samples += 1
+
+    def run(self, duration: float) -> None:
+        """Samples for ``duration`` seconds (blocking, meant to be run in its own thread)"""
+        own = threading.get_ident()
+        end = time.perf_counter() + duration
+        next_sample = time.perf_counter()
+        while (now := time.perf_counter()) < end:
+            self._sample(own)
+            next_sample = max(next_sample + self.interval, now)  # no catching up after the GIL was held for long
+            time.sleep(max(0.0, next_sample - time.perf_counter()))
+
+    def collapsed(self) -> str:
+        """Folded stacks (``thread;root;...;leaf samples``), as read by ``flamegraph.pl``, speedscope, ..."""
+        lines: Counter[str] = Counter()
+        for (thread, stack), n in self.stacks.items():
+            lines[";".join((thread, *(f"{name} ({file}:{line})" for file, line, name in stack)))] += n
+        return "".join(f"{line} {n}\n" for line, n in sorted(lines.items()))
+
+    def pstats(self) -> bytes:
+        """The samples in the format of ``pstats.Stats.dump_stats`` (so ``snakeviz`` etc. can read them)
+
+        Calls are the samples a function was on the stack, the times are derived from them with ``interval``.
+        """
+        stats: dict[Frame, list] = {}  # function: [primitive calls, calls, own time, cumulative time, callers]
+        for (_, stack), n in self.stacks.items():
+            duration = n * self.interval
+            for i, function in enumerate(stack):
+                entry = stats.setdefault(function, [0, 0, 0.0, 0.0, {}])
+                leaf = i == len(stack) - 1
+                if function not in stack[i + 1 :]:  # recursive functions are counted once per sample
+                    entry[0] += n
+                    entry[1] += n
+                    entry[3] += duration
+                if leaf:
+                    entry[2] += duration
+                if i:
+                    caller = entry[4].setdefault(stack[i - 1], [0, 0, 0.0, 0.0])
+                    caller[0] += n
+                    caller[1] += n
+                    caller[2] += duration if leaf else 0
+                    caller[3] += duration
+        return marshal.dumps(
+            {
+                function: (cc, nc, tt, ct, {caller: tuple(values) for caller, values in callers.items()})
+                for function, (cc, nc, tt, ct, callers) in stats.items()
+            }
+        )
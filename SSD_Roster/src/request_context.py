@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "request_id",
+    "RequestIDMiddleware",
+)
+
+
+# standard library
+from contextvars import ContextVar
+from itertools import count
+
+# typing
+from typing import Optional
+
+# fastapi
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+"""ID of the request which is currently handled (``None`` outside of requests)."""
+
+_counter = count(1)
+
+
+class RequestIDMiddleware:
+    """Sets ``request_id`` for every HTTP/WebSocket request and returns it as ``X-Request-ID``"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        current = f"{next(_counter):x}"
+        token = request_id.set(current)
+
+        async def send_with_header(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", current.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            request_id.reset(token)
@@ -1,14 +1,27 @@
 from __future__ import annotations
 
 
-__all__ = ("Roster",)
+__all__ = (
+    "Roster",
+    "roster_broadcaster",
+    "roster_diff",
+    "publish_roster",
+)
 
 
 # standard library
-from datetime import date
+from datetime import date, datetime
+
+# third party
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# typing
+from typing import Optional
 
 # local
-from .models import RosterSchema
+from .broadcast import EventBroadcaster
+from .database import database
+from .models import RosterModel, RosterSchema, UserID
 
 
 class Roster(RosterSchema):
@@ -20,3 +33,59 @@ class Roster(RosterSchema):
 
     def export_to_pdf(self):  # noqa ANN201
         raise NotImplementedError  # ToDo: use src.pdf.create_roster
+
+
+roster_broadcaster = EventBroadcaster()
+"""Topics are ``(year, week)``; every publication of that roster is sent as ``"roster"``-event."""
+
+_COLUMNS = tuple(column.name for column in RosterModel.__table__.columns if column.name != "roster_id")
+
+
+def roster_diff(old: Optional[RosterSchema], new: RosterSchema) -> list[tuple[int, int, int, Optional[UserID]]]:
+    """Every changed slot as ``(day, shift, position, user_id)`` (compared to an empty roster if there's no ``old``)"""
+    old_matrix = old.user_matrix if old is not None else RosterSchema.model_fields["user_matrix"].get_default()
+    return [
+        (day, shift, position, user_id)
+        for day, (old_day, new_day) in enumerate(zip(old_matrix, new.user_matrix))
+        for shift, (old_shift, new_shift) in enumerate(zip(old_day, new_day))
+        for position, (old_user_id, user_id) in enumerate(zip(old_shift, new_shift))
+        if old_user_id != user_id
+    ]
+
+
+async def publish_roster(roster: RosterSchema, published_by: UserID) -> RosterSchema:
+    """Stores (or replaces) the roster of its week as published and pushes the changes to the subscribers"""
+    year, week = roster.date_anchor
+    roster = roster.model_copy(update={"published_by": published_by, "published_at": datetime.utcnow()})
+    model = roster.to_model()
+    values = {column: getattr(model, column) for column in _COLUMNS} | {"published": True}
+
+    async with database.transaction():
+        # only one of concurrent publications of a new week inserts it, the others replace it afterwards
+        created = await database.fetch_one(
+            sqlite_insert(RosterModel)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=["year", "week"])
+            .returning(RosterModel.roster_id)
+        )
+        old = None
+        if created is None:
+            # the ``INSERT`` already took the write-lock, so the week can't change until it's replaced
+            old = await database.fetch_one(
+                RosterModel.select().where(RosterModel.year == year, RosterModel.week == week)
+            )
+            await database.execute(RosterModel.update().where(RosterModel.roster_id == old.roster_id).values(**values))
+
+    roster_broadcaster.publish(
+        (year, week),
+        "roster",
+        {
+            "year": year,
+            "week": week,
+            "published_by": published_by,
+            "published_at": roster.published_at,
+            "created": old is None,
+            "changes": roster_diff(RosterModel.to_schema(old) if old is not None else None, roster),
+        },
+    )
+    return roster
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "SessionBackend",
+    "MemorySessionBackend",
+    "SQLiteSessionBackend",
+    "LazySession",
+    "load_session",
+    "ServerSessionMiddleware",
+)
+
+
+# standard library
+import asyncio
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from pathlib import Path
+
+# third party
+import orjson
+
+# typing
+from typing import Any, Callable, Iterator, Optional
+
+# fastapi
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection, Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class SessionBackend(ABC):
+    """Stores the (JSON-serializable) data of the sessions by their ID
+
+    The methods are synchronous, as the session is loaded when a handler first touches ``request.session``
+    (which isn't awaitable); so they have to be fast. Backends which block (e.g. on I/O) set ``blocking``, then
+    they're called in a thread: ``ServerSessionMiddleware`` saves that way and the ``load_session``-dependency of
+    the routes which use the session loads that way.
+    """
+
+    blocking: bool = False
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[dict[str, Any]]:
+        """``None`` if there is no such (unexpired) session"""
+
+    @abstractmethod
+    def save(self, session_id: str, data: dict[str, Any], max_age: int) -> None: ...
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None: ...
+
+
+class MemorySessionBackend(SessionBackend):
+    """Keeps the ``maxsize`` most recently used sessions of this process (not shared between workers)"""
+
+    def __init__(self, maxsize: int = 10_000):
+        self.maxsize = maxsize
+        self._sessions: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def load(self, session_id: str) -> Optional[dict[str, Any]]:
+        try:
+            expires_at, data = self._sessions[session_id]
+        except KeyError:
+            return None
+        if expires_at < time.time():
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return orjson.loads(data)  # stored serialized, so nobody changes it by accident
+
+    def save(self, session_id: str, data: dict[str, Any], max_age: int) -> None:
+        self._sessions[session_id] = (time.time() + max_age, orjson.dumps(data))
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Keeps the sessions in their own SQLite file, so they're shared between workers and survive restarts
+
+    ``timeout`` is how long a call waits for the lock of another worker before it raises.
+    """
+
+    PURGE_INTERVAL = 3600  # seconds
+    blocking = True
+
+    def __init__(self, path: str | Path, timeout: float = 1.0):
+        self.path = Path(path)
+        self._connection = sqlite3.connect(self.path, timeout, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")  # no fsync per save, a crash may lose the last ones
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS session (session_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, data BLOB)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_session_expires_at ON session (expires_at)")
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def load(self, session_id: str) -> Optional[dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM session WHERE session_id = ? AND expires_at >= ?", (session_id, time.time())
+            ).fetchone()
+        return orjson.loads(row[0]) if row is not None else None
+
+    def save(self, session_id: str, data: dict[str, Any], max_age: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO session (session_id, expires_at, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET expires_at = excluded.expires_at, data = excluded.data",
+                (session_id, now + max_age, orjson.dumps(data)),
+            )
+            if now >= self._next_purge:  # expired sessions would be ignored anyway, this just keeps the file small
+                self._connection.execute("DELETE FROM session WHERE expires_at < ?", (now,))
+                self._next_purge = now + self.PURGE_INTERVAL
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM session WHERE session_id = ?", (session_id,))
+
+
+class LazySession(MutableMapping):
+    """``request.session`` which only asks the backend for the data once it's accessed
+
+    ``await load()`` loads it without blocking the event loop (in a thread, if ``blocking``); accessing it before
+    still works, but calls the backend right away.
+    """
+
+    def __init__(self, load: Callable[[], Optional[dict[str, Any]]], blocking: bool = False):
+        self._load = load
+        self.blocking = blocking
+        self._data: Optional[dict[str, Any]] = None
+        self._snapshot = b"{}"
+        self.exists = False
+        """Whether the backend knew the session (only known once ``loaded``)."""
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def _loaded(self, data: Optional[dict[str, Any]]) -> None:
+        self.exists = data is not None
+        self._data = data or {}
+        self._snapshot = orjson.dumps(self._data)
+
+    async def load(self) -> None:
+        if self._data is None:
+            data = await asyncio.to_thread(self._load) if self.blocking else self._load()
+            if self._data is None:  # unless it got accessed meanwhile
+                self._loaded(data)
+
+    @property
+    def data(self) -> dict[str, Any]:
+        if self._data is None:
+            self._loaded(self._load())
+        return self._data
+
+    @property
+    def modified(self) -> bool:
+        # compared serialized, as nested values (e.g. the list of flashed messages) are changed in place
+        return self._data is not None and orjson.dumps(self._data) != self._snapshot
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.data[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self.data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def clear(self) -> None:  # as ``MutableMapping.clear`` pops item by item
+        self.data.clear()
+
+
+async def load_session(request: Request) -> None:
+    """Dependency of the routes which use the session (flash messages or render templates), loads it beforehand"""
+    if isinstance(session := request.scope.get("session"), LazySession):
+        await session.load()
+
+
+class ServerSessionMiddleware:
+    """Replacement for Starlette's ``SessionMiddleware`` which keeps only an opaque ID in the cookie
+
+    The session is loaded lazily (by ``load_session`` or when it's accessed first) and only saved if it got
+    changed. Requests to paths ending with one of ``skip_suffixes`` (the API) or starting with one of
+    ``skip_prefixes`` (the static files) get a plain, empty dictionary which is never stored.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        backend: SessionBackend,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 60 * 60,  # 14 days, in seconds
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+        skip_suffixes: tuple[str, ...] = (".api",),
+        skip_prefixes: tuple[str, ...] = ("/static/",),
+    ):
+        self.app = app
+        self.backend = backend
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.skip_suffixes = skip_suffixes
+        self.skip_prefixes = skip_prefixes
+        self.cookie_attributes = f"path={path}; Max-Age={max_age}; httponly; samesite={same_site}"
+        if https_only:
+            self.cookie_attributes += "; secure"
+        self.delete_attributes = f"path={path}; expires=Thu, 01 Jan 1970 00:00:00 GMT; httponly; samesite={same_site}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        if scope["path"].endswith(self.skip_suffixes) or scope["path"].startswith(self.skip_prefixes):
+            scope["session"] = {}
+            return await self.app(scope, receive, send)
+
+        session_id = HTTPConnection(scope).cookies.get(self.session_cookie)
+        if session_id:
+            session = LazySession(lambda: self.backend.load(session_id), self.backend.blocking)
+        else:
+            session = LazySession(lambda: None)
+        scope["session"] = session
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start" and session.modified:
+                headers = MutableHeaders(scope=message)
+                if session:
+                    # unknown IDs (expired or made up by the client) aren't reused
+                    new_id = session_id if session.exists else secrets.token_urlsafe(32)
+                    await self._call(self.backend.save, new_id, session.data, self.max_age)
+                    headers.append("Set-Cookie", f"{self.session_cookie}={new_id}; {self.cookie_attributes}")
+                elif session.exists:  # emptied, so it doesn't need to be stored anymore
+                    await self._call(self.backend.delete, session_id)
+                    headers.append("Set-Cookie", f"{self.session_cookie}=null; {self.delete_attributes}")
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _call(self, function: Callable[..., None], *args: Any) -> None:
+        if self.backend.blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+
+__all__ = ("SharedLogBuffer",)
+
+
+# standard library
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# third party
+import orjson
+
+# typing
+from typing import Iterator, Optional
+
+# local
+from .log_store import Level, LogBuffer, LogRecord, LogSubscription, Source
+
+
+_MAGIC = b"SSDLOG01"
+_HEADER = struct.Struct("<8sQQQ")  # magic, capacity, slot size, next sequence number
+_HEADER_SIZE = 64
+_NEXT_SEQ_OFFSET = 24
+_SLOT_HEADER = struct.Struct("<QI")  # sequence number + 1 (0 while empty/being written), payload length
+_TRUNCATED = " [truncated]"
+
+
+class SharedLogBuffer(LogBuffer):
+    """``LogBuffer`` in a memory-mapped file, so every worker process appends to (and reads) the same ring
+
+    The file consists of a small header and ``capacity`` slots of ``slot_size`` bytes, so its size doesn't depend
+    on the amount of workers. Sequence numbers are taken from the header under a short file-lock (the only moment
+    a writer waits for other processes); the slot is written afterwards. Messages which don't fit into a slot are
+    truncated.
+
+    Subscriptions are fed by a thread which polls the ring, so they receive the records of every worker.
+    POSIX only (file-locks by ``fcntl``, which is only imported once a buffer is created).
+    """
+
+    POLL_INTERVAL = 0.2  # seconds
+    MAX_POLLS_UNCOMMITTED = 10  # a slot which isn't written after this many polls belongs to a crashed writer
+
+    def __init__(self, path: str | Path, capacity: int, slot_size: int = 8192):
+        if capacity < 1:
+            raise ValueError("capacity has to be at least 1")
+        if slot_size < 256:
+            raise ValueError("slot_size has to be at least 256")
+        self.path = Path(path)
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self._subscriptions: tuple[LogSubscription, ...] = ()
+        self._lock = threading.Lock()  # file-locks are per process, this one is for the threads of this process
+        self._poller: Optional[threading.Thread] = None
+        self._poller_lock = threading.Lock()
+
+        # standard library
+        import fcntl  # not available on every platform, so only imported if the shared buffer is used
+
+        self._fcntl = fcntl
+        size = _HEADER_SIZE + capacity * slot_size
+        self._fd = self._open(size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _open(self, size: int) -> int:
+        """Opens the file (and initialises it, if it's new); a file with another layout is replaced, not changed"""
+        fcntl = self._fcntl
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            opened = False
+            fcntl.flock(fd, fcntl.LOCK_EX)  # the first worker initialises the file, the others wait for it
+            try:
+                if not self._is_current(fd):  # replaced while waiting for the lock
+                    continue
+                header = os.pread(fd, _HEADER.size, 0)
+                if len(header) < _HEADER.size:  # a new file, nobody maps it before it's initialised
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, _HEADER.pack(_MAGIC, self.capacity, self.slot_size, 0), 0)
+                elif _HEADER.unpack(header)[:3] != (_MAGIC, self.capacity, self.slot_size):
+                    # workers which are still running may have it mapped; shrinking it would crash them (SIGBUS)
+                    self._replace(size)
+                    continue
+                opened = True
+                return fd
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                if not opened:
+                    os.close(fd)
+
+    def _is_current(self, fd: int) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_dev, stat.st_ino) == (os.fstat(fd).st_dev, os.fstat(fd).st_ino)
+
+    def _replace(self, size: int) -> None:
+        """Atomically replaces the file with an initialised one (processes which map the old one keep it)"""
+        fd, temporary = tempfile.mkstemp(prefix=f".{self.path.name}.", dir=self.path.parent)
+        try:
+            os.ftruncate(fd, size)
+            os.pwrite(fd, _HEADER.pack(_MAGIC, self.capacity, self.slot_size, 0), 0)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        finally:
+            os.close(fd)
+        os.replace(temporary, self.path)
+        sys.stderr.write(
+            f"WARNING: {self.path} had another layout and got replaced "
+            "(workers which still use the old one don't share their logs with the new ones)\n"
+        )
+
+    def _next_seq(self) -> int:
+        fcntl = self._fcntl
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 8, _NEXT_SEQ_OFFSET)
+            try:
+                (seq,) = struct.unpack_from("<Q", self._map, _NEXT_SEQ_OFFSET)
+                struct.pack_into("<Q", self._map, _NEXT_SEQ_OFFSET, seq + 1)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 8, _NEXT_SEQ_OFFSET)
+        return seq
+
+    def _peek_next_seq(self) -> int:
+        return struct.unpack_from("<Q", self._map, _NEXT_SEQ_OFFSET)[0]
+
+    def _offset(self, seq: int) -> int:
+        return _HEADER_SIZE + (seq % self.capacity) * self.slot_size
+
+    def _encode(self, record: LogRecord) -> bytes:
+        room = self.slot_size - _SLOT_HEADER.size
+        message = record.message
+        while True:
+            payload = orjson.dumps(
+                (record.timestamp.timestamp(), record.source, record.level, message, record.request_id)
+            )
+            if len(payload) <= room:
+                return payload
+            # every character takes at least one byte, so this always cuts enough (or more, for escaped ones)
+            message = message[: max(0, len(message) - len(_TRUNCATED) - (len(payload) - room))] + _TRUNCATED
+
+    def append(self, source: Source, level: Level, message: str, request_id: Optional[str] = None) -> LogRecord:
+        seq = self._next_seq()
+        record = LogRecord(seq, datetime.now(timezone.utc), source, level, message, request_id)
+        payload = self._encode(record)
+        offset = self._offset(seq)
+        if _SLOT_HEADER.unpack_from(self._map, offset)[0] > seq + 1:
+            return record  # this writer was so slow that the ring already went round, the record is outdated anyway
+        # mark the slot as incomplete first, so readers skip it until it's fully written
+        _SLOT_HEADER.pack_into(self._map, offset, 0, 0)
+        self._map[offset + _SLOT_HEADER.size : offset + _SLOT_HEADER.size + len(payload)] = payload
+        _SLOT_HEADER.pack_into(self._map, offset, seq + 1, len(payload))
+        return record
+
+    def _read(self, seq: int) -> Optional[LogRecord]:
+        """The record in the slot of ``seq`` (which may be a newer one), or ``None`` if the slot isn't written"""
+        offset = self._offset(seq)
+        stored, length = _SLOT_HEADER.unpack_from(self._map, offset)
+        if not stored or length > self.slot_size - _SLOT_HEADER.size:
+            return None
+        start = offset + _SLOT_HEADER.size
+        payload = self._map[start : start + length]  # only the payload is copied, not the whole slot
+        if _SLOT_HEADER.unpack_from(self._map, offset)[0] != stored:  # (being) overwritten meanwhile
+            return None
+        try:
+            timestamp, source, level, message, request_id = orjson.loads(payload)
+        except (orjson.JSONDecodeError, ValueError):  # torn read
+            return None
+        return LogRecord(
+            stored - 1, datetime.fromtimestamp(timestamp, timezone.utc), source, level, message, request_id
+        )
+
+    def __len__(self) -> int:
+        return min(self._peek_next_seq(), self.capacity)
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        """Oldest to newest; only the slots of the last ``capacity`` sequence numbers are read"""
+        end = self._peek_next_seq()
+        # records of other sequence numbers are either newer (appended meanwhile) or left by writers which lost a race
+        return (
+            record
+            for seq in range(max(0, end - self.capacity), end)
+            if (record := self._read(seq)) is not None and record.seq == seq
+        )
+
+    def subscribe(self, maxsize: int = 1000) -> LogSubscription:
+        subscription = LogSubscription(maxsize)
+        with self._poller_lock:
+            self._subscriptions = (*self._subscriptions, subscription)
+            if self._poller is None:
+                self._poller = threading.Thread(
+                    target=self._poll, args=(self._peek_next_seq(),), name="log-poller", daemon=True
+                )
+                self._poller.start()
+        return subscription
+
+    def _poll(self, last: int) -> None:
+        """Pushes the records of every worker to the subscriptions; stops once nobody is subscribed anymore"""
+        waiting = 0
+        while True:
+            with self._poller_lock:
+                if not self._subscriptions:
+                    self._poller = None
+                    return
+            end = self._peek_next_seq()
+            last = max(last, end - self.capacity)  # the rest is already overwritten
+            while last < end:
+                record = self._read(last)
+                if record is None or record.seq < last:  # not (completely) written yet
+                    waiting += 1
+                    if waiting < self.MAX_POLLS_UNCOMMITTED:
+                        break
+                elif record.seq == last:
+                    for subscription in self._subscriptions:
+                        subscription.push(record)
+                # else it's already overwritten by a newer record, which is pushed once it's its turn
+                waiting = 0
+                last += 1
+            time.sleep(self.POLL_INTERVAL)
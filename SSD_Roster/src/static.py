@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+
+__all__ = (
+    "accepted_encodings",
+    "PrecompressedStaticFiles",
+    "static_files",
+)
+
+
+# standard library
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# third party
+import brotli
+import orjson
+
+# typing
+from typing import Callable, Optional
+
+# fastapi
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+# local
+from .environment import settings
+
+
+_COMPRESSORS: dict[str, tuple[str, Callable[[bytes], bytes]]] = {
+    # encoding: (suffix, compress); the preferred encoding first
+    "br": (".br", lambda data: brotli.compress(data, quality=11)),
+    "gzip": (".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+}
+_IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    """The content-codings of an ``Accept-Encoding``-header (without the ones with ``q=0``)"""
+    accepted = set()
+    for coding in accept_encoding.split(","):
+        name, _, parameters = coding.partition(";")
+        quality = parameters.strip().removeprefix("q=")
+        try:
+            if parameters and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """``StaticFiles`` which serves precompressed variants and lets fingerprinted URLs be cached forever
+
+    ``build`` compresses every compressible file (with every encoding of ``_COMPRESSORS``) into ``build_directory``
+    and hashes its content; a variant is only built once per content. The hashes (by size and modification time of
+    the file) and the encodings which didn't make a file smaller are kept in a manifest next to the variants, so
+    unchanged files are neither read nor compressed again on the next start. ``url`` adds that hash to the URL, so
+    responses to it are cached as ``immutable``; other URLs have to be revalidated (``ETag``/``Last-Modified``).
+    Files are sent with ``FileResponse``, which hands the path to the server if it supports ``pathsend``.
+    """
+
+    COMPRESSIBLE = frozenset({".css", ".js", ".json", ".svg", ".txt", ".webmanifest", ".ico", ".html"})
+    MIN_SIZE = 1024  # bytes; smaller files aren't worth it
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory: str, build_directory: str = "", prefix: str = "/static", immutable: bool = True):
+        super().__init__(directory=directory)
+        self.prefix = prefix
+        self.immutable = immutable
+        self.build_directory = Path(build_directory or Path(tempfile.gettempdir(), "ssd_roster-static"))
+        self._hashes: dict[str, str] = {}
+        self._variants: dict[str, dict[str, str]] = {}  # path: {encoding: file}
+
+    def _load_manifest(self) -> dict[str, dict]:
+        try:
+            return orjson.loads(self.build_directory.joinpath(self.MANIFEST).read_bytes())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return {}
+
+    def _write(self, target: Path, content: bytes) -> None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # written aside and renamed, as other workers may build the same file at the same time
+        temporary = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        temporary.write_bytes(content)
+        temporary.replace(target)
+
+    def build(self) -> int:
+        """Hashes and compresses every (changed) file (blocking); returns the amount of built variants"""
+        start = time.perf_counter()
+        built = 0
+        hashes, variants = {}, {}
+        manifest = self._load_manifest()
+        changed = False
+        for file in sorted(Path(self.directory).rglob("*")):
+            if not file.is_file():
+                continue
+            path = file.relative_to(self.directory).as_posix()
+            stat = file.stat()
+            content: Optional[bytes] = None
+            entry = manifest.get(path)
+            if entry is None or (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                content = file.read_bytes()
+                entry = manifest[path] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "digest": hashlib.sha256(content).hexdigest()[:16],
+                    "incompressible": [],  # encodings whose variant wasn't smaller
+                }
+                changed = True
+            hashes[path] = digest = entry["digest"]
+            if file.suffix not in self.COMPRESSIBLE or stat.st_size < self.MIN_SIZE:
+                continue
+            for encoding, (suffix, compress) in _COMPRESSORS.items():
+                if encoding in entry["incompressible"]:
+                    continue
+                variant = self.build_directory.joinpath(f"{path}.{digest}{suffix}")
+                if not variant.exists():  # e.g. a new file or removed from the temp-directory
+                    if content is None:
+                        content = file.read_bytes()
+                    compressed = compress(content)
+                    if len(compressed) >= len(content):
+                        entry["incompressible"].append(encoding)
+                        changed = True
+                        continue
+                    self._write(variant, compressed)
+                    built += 1
+                variants.setdefault(path, {})[encoding] = str(variant)
+        if changed or manifest.keys() != hashes.keys():
+            self._write(
+                self.build_directory.joinpath(self.MANIFEST),
+                orjson.dumps({path: manifest[path] for path in hashes}),  # removed files are dropped
+            )
+        self._hashes, self._variants = hashes, variants
+        sys.stdout.write(
+            f"INFO: prepared {len(hashes)} static file(s) ({built} newly compressed variant(s)) "
+            f"in {time.perf_counter() - start:.3f}s\n"
+        )
+        return built
+
+    def url(self, path: str) -> str:
+        """The URL of the file with its fingerprint (as long as the file is known)"""
+        digest = self._hashes.get(path.lstrip("/"))
+        return f"{self.prefix}/{path.lstrip('/')}" + (f"?v={digest}" if digest and self.immutable else "")
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+        path = Path(path).as_posix()  # the same normalisation as for the hashes (e.g. no leading "./")
+        variants = self._variants.get(path)
+        encoding: Optional[str] = None
+        if variants:
+            accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+            encoding = next((encoding for encoding in variants if encoding in accepted), None)
+
+        if encoding is None:
+            response = await super().get_response(path, scope)
+        else:
+            full_path = variants[encoding]
+            try:
+                response = self.file_response(full_path, os.stat(full_path), scope)
+            except FileNotFoundError:  # removed from the temp-directory meanwhile
+                self._variants.pop(path, None)
+                return await self.get_response(path, scope)
+            response.headers["Content-Encoding"] = encoding
+            response.headers["Content-Type"] = self._media_type(path)
+
+        if variants:
+            response.headers["Vary"] = "Accept-Encoding"
+        if response.status_code in (200, 304):
+            digest = self._hashes.get(path)
+            fingerprinted = digest is not None and f"v={digest}".encode() in scope.get("query_string", b"").split(b"&")
+            response.headers["Cache-Control"] = _IMMUTABLE if self.immutable and fingerprinted else "no-cache"
+        return response
+
+    @staticmethod
+    def _media_type(path: str) -> str:
+        media_type = mimetypes.guess_type(path)[0] or "text/plain"
+        return f"{media_type}; charset=utf-8" if media_type.startswith("text/") else media_type
+
+
+static_files = PrecompressedStaticFiles(
+    "static", settings.STATIC.BUILD_DIRECTORY, immutable=settings.ENVIRONMENT == "production"
+)
+"""Mounted as ``/static``; ``build`` has to be called once, before the first request."""
@@ -1,27 +1,150 @@
 from __future__ import annotations
 
 
-__all__ = ("templates",)
+__all__ = (
+    "bytecode_cache",
+    "StreamingTemplateResponse",
+    "StreamingTemplates",
+    "templates",
+    "precompile",
+)
 
 
 # standard library
+import sys
+import time
 from pathlib import Path
 
+# typing
+from typing import Any, AsyncIterator, Mapping, Optional
+
 # fastapi
 from fastapi.templating import Jinja2Templates
-from jinja2.environment import Environment
+from jinja2.bccache import BytecodeCache, FileSystemBytecodeCache
+from jinja2.environment import Environment, Template
 from jinja2.loaders import FileSystemLoader
+from starlette.background import BackgroundTask
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
 
 # local
+from .environment import settings
 from .messages import get_flashed_messages
+from .models import MessageCategory
+from .static import static_files
+
+
+def _bytecode_cache(pattern: str) -> Optional[BytecodeCache]:
+    if not settings.TEMPLATES.BYTECODE_CACHE:
+        return None
+    if settings.TEMPLATES.BYTECODE_CACHE_DIR:
+        Path(settings.TEMPLATES.BYTECODE_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    return FileSystemBytecodeCache(settings.TEMPLATES.BYTECODE_CACHE_DIR or None, pattern)
+
+
+bytecode_cache = _bytecode_cache("__jinja2_%s.cache")
+"""For synchronous environments (the code compiled for ``enable_async`` differs, so it has its own files)."""
+
+
+class StreamingTemplateResponse(StreamingResponse):
+    """Renders the template with ``generate_async`` and sends the output in chunks of about ``CHUNK_SIZE`` characters
+
+    The first chunk is rendered before the response is started, so errors in the beginning of a template (where
+    most of the logic is) still end up in the exception handlers.
+    """
+
+    media_type = "text/html"
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(
+        self,
+        template: Template,
+        context: dict[str, Any],
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ):
+        self.template = template
+        self.context = context
+        super().__init__(self._chunks(), status_code, headers, media_type, background)
+
+    async def _chunks(self) -> AsyncIterator[bytes]:
+        buffer, size = [], 0
+        async for part in self.template.generate_async(self.context):
+            buffer.append(part)
+            size += len(part)
+            if size >= self.CHUNK_SIZE:
+                yield "".join(buffer).encode(self.charset)
+                buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer).encode(self.charset)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if "http.response.debug" in scope.get("extensions", {}):  # e.g. for the ``TestClient``, as starlette does
+            await send({"type": "http.response.debug", "info": {"template": self.template, "context": self.context}})
+
+        chunks = self.body_iterator
+        first = await anext(chunks, b"")
 
+        async def resumed() -> AsyncIterator[bytes]:
+            yield first
+            async for chunk in chunks:
+                yield chunk
 
-# public instance of Jinja2Templates
-templates = Jinja2Templates(
+        self.body_iterator = resumed()
+        await super().__call__(scope, receive, send)
+
+
+class StreamingTemplates(Jinja2Templates):
+    """``Jinja2Templates`` for an environment with ``enable_async``, whose ``TemplateResponse`` streams
+
+    Globals with side effects on the response (``get_flashed_messages`` changes the session, which is stored when
+    the response is started) are evaluated before the streaming starts and passed as part of the context.
+    """
+
+    def TemplateResponse(  # noqa N802
+        self,
+        request: Request,
+        name: str,
+        context: Optional[dict[str, Any]] = None,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+    ) -> StreamingTemplateResponse:
+        context = context or {}
+        context.setdefault("request", request)
+        for context_processor in self.context_processors:
+            context.update(context_processor(request))
+
+        flashed = get_flashed_messages(request)
+
+        def flashed_messages(_: Request, category: MessageCategory | str = "*") -> list[dict]:
+            return [message for message in flashed if category in ("*", message["ctg"])]
+
+        context.setdefault("get_flashed_messages", flashed_messages)
+
+        return StreamingTemplateResponse(
+            self.get_template(name),
+            context,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            background=background,
+        )
+
+
+# public instance of StreamingTemplates
+templates = StreamingTemplates(
     env=Environment(  # basically the default environment generated by starlette
         loader=FileSystemLoader(["templates", "static"]),
         autoescape=True,
-        # enable_async=True,  # will raise "RuntimeError: this event loop is already running." when templates are used
+        enable_async=True,  # so ``TemplateResponse`` can stream (``Template.render`` can't be used anymore)
+        bytecode_cache=_bytecode_cache("__jinja2_async_%s.cache"),
+        auto_reload=settings.ENVIRONMENT == "development",  # otherwise the files aren't stat()ed on every render
+        cache_size=-1,  # every template stays compiled (there are only a few of them)
     )
 )
 
@@ -31,3 +154,17 @@ templates.env.globals.pop("__builtins__")
 # ToDo: maybe append REV/HEAD (or whatever the hash-id is called) to templates.env.globals["__version__"]
 
 templates.env.globals["get_flashed_messages"] = get_flashed_messages
+templates.env.globals["static_url"] = static_files.url
+
+
+def precompile(directory: str = "templates") -> int:
+    """Compiles (or loads from the bytecode cache) every template of ``directory``, so no request has to
+
+    Blocking, as it reads and compiles the files; returns the amount of templates.
+    """
+    start = time.perf_counter()
+    names = [path.relative_to(directory).as_posix() for path in Path(directory).rglob("*.html")]
+    for name in names:
+        templates.env.get_template(name)
+    sys.stdout.write(f"INFO: precompiled {len(names)} template(s) in {time.perf_counter() - start:.3f}s\n")
+    return len(names)
@@ -1,18 +1,34 @@
 from __future__ import annotations
 
 
-__all__ = ("Timetable",)
+__all__ = (
+    "Timetable",
+    "is_existing_week",
+    "parse_iso_week",
+    "iter_weeks",
+    "upsert_timetables",
+)
 
 
 # standard library
-from datetime import date
+from datetime import date, timedelta
+
+# third party
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 # typing
 import annotated_types
-from typing import Annotated
+from typing import Annotated, Iterable, Iterator
 
 # local
-from .models import Availability, TimetableSchema
+from .database import database
+from .models import Availability, IsoWeek, TimetableModel, TimetableSchema, Week, Year
+
+
+_KEY_COLUMNS = ("user_id", "year", "week")
+_SLOT_COLUMNS = tuple(
+    column.name for column in TimetableModel.__table__.columns if column.name not in ("timetable_id", *_KEY_COLUMNS)
+)
 
 
 class Timetable(TimetableSchema):
@@ -22,6 +38,10 @@ class Timetable(TimetableSchema):
         year, week = self.date_anchor
         return date.fromisocalendar(year, week, 1), date.fromisocalendar(year, week, 5)
 
+    def to_compact(self) -> str:
+        """The matrix as 20 digits (``day*4+slot``), e.g. ``"0120..."``"""
+        return "".join(str(int(availability)) for day in self.availability_matrix for availability in day)
+
     @staticmethod
     def matrix_from_form(
         form_data: list[tuple[Annotated[str, annotated_types.MinLen(2), annotated_types.MaxLen(2)], str]], /
@@ -43,3 +63,50 @@ class Timetable(TimetableSchema):
             for j in range(4):
                 matrix[-1].append(Availability(int(data[f"{i}{j}"])))
         return matrix
+
+
+def is_existing_week(year: int, week: int, /) -> bool:
+    """Whether the ISO week exists (e.g. not every year has a week 53)"""
+    try:
+        date.fromisocalendar(year, week, 1)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_iso_week(iso_week: IsoWeek, /) -> tuple[Year, Week]:
+    """Converts ``"YYYY-Www"`` to ``(year, week)``; raises ``ValueError`` if the week doesn't exist in that year"""
+    year, week = int(iso_week[:4]), int(iso_week[6:])
+    if not is_existing_week(year, week):
+        raise ValueError(f"{iso_week} doesn't exist")
+    return year, week
+
+
+def iter_weeks(start: tuple[Year, Week], stop: tuple[Year, Week], /) -> Iterator[tuple[Year, Week]]:
+    """Yields every ``(year, week)`` from ``start`` to ``stop`` (both inclusive)"""
+    first, last = date.fromisocalendar(*start, 1), date.fromisocalendar(*stop, 1)
+    # counted instead of compared, as stepping past the last week of year 9999 overflows ``date``
+    for weeks in range((last - first).days // 7 + 1):
+        iso = (first + timedelta(weeks=weeks)).isocalendar()
+        yield iso.year, iso.week
+
+
+async def upsert_timetables(timetables: Iterable[TimetableSchema], /) -> int:
+    """Inserts or updates (by user and week) every timetable with a single statement; returns the amount of weeks"""
+    rows = {}
+    for timetable in timetables:  # a week may only be affected once per statement; the last one wins
+        model = timetable.to_model()
+        rows[(model.user_id, model.year, model.week)] = {
+            name: int(getattr(model, name)) for name in (*_KEY_COLUMNS, *_SLOT_COLUMNS)
+        }
+    if not rows:
+        return 0
+
+    query = sqlite_insert(TimetableModel).values(list(rows.values()))
+    query = query.on_conflict_do_update(
+        index_elements=_KEY_COLUMNS,
+        set_={name: query.excluded[name] for name in _SLOT_COLUMNS},
+    )
+    async with database.transaction():
+        await database.execute(query)
+    return len(rows)
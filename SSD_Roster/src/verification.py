@@ -3,16 +3,45 @@ from __future__ import annotations
 
 __all__ = (
     "generate_code",
+    "store_code",
     "verify_code",
+    "get_queue",
+    "accept_users",
+    "reject_users",
+    "VerificationCodePurge",
+    "verification_code_purge",
 )
 
 
 # standard library
+import asyncio
+import sys
+import traceback
+from datetime import datetime, timedelta
 from random import choices
 
+# third party
+from databases.interfaces import Record
+from sqlalchemy import func, select
+
+# typing
+from typing import Iterable, Optional
+
 # local
 from .database import database
-from .models import UserSchema, VerificationCodesModel
+from .environment import settings
+from .messages import add_messages
+from .models import (
+    EmailOutboxModel,
+    MessageCategory,
+    MessageModel,
+    MessageSchema,
+    UnreadCountModel,
+    UserID,
+    UserModel,
+    UserSchema,
+    VerificationCodesModel,
+)
 
 
 # excluding some characters like "I", "O" and "0" to prevent confusion
@@ -23,12 +52,170 @@ def generate_code() -> str:
     return "{}-{}-{}-{}".format(*["".join(choices(_CHARACTERS, k=2)) for _ in range(4)])
 
 
+async def store_code(user_id: UserID, email: str, code: str) -> datetime:
+    """Stores the code (valid for ``VERIFICATION.CODE_LIFETIME`` hours); returns when it expires"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(hours=settings.VERIFICATION.CODE_LIFETIME)
+    await database.execute(
+        VerificationCodesModel.insert().values(
+            user_id=user_id, email=email, code=code, created_at=now, expires_at=expires_at
+        )
+    )
+    return expires_at
+
+
 async def verify_code(user: UserSchema, code: str) -> bool:
     return (
         await database.fetch_one(
-            VerificationCodesModel.select().where(
-                VerificationCodesModel.user_id == user.user_id, VerificationCodesModel.code == code
+            select(VerificationCodesModel.user_id).where(
+                VerificationCodesModel.user_id == user.user_id,
+                VerificationCodesModel.code == code,
+                VerificationCodesModel.expires_at > datetime.utcnow(),
             )
         )
         is not None
     )
+
+
+async def get_queue(offset: int, limit: int) -> tuple[list[Record], int]:
+    """Users waiting for an admin (with the expiry of their code, if any) and their total amount, in one query"""
+    rows = await database.fetch_all(
+        select(
+            UserModel.user_id,
+            UserModel.email,
+            UserModel.displayed_name,
+            UserModel.birthday,
+            UserModel.scopes,
+            UserModel.email_verified,
+            VerificationCodesModel.expires_at.label("code_expires_at"),
+            func.count().over().label("total"),
+        )
+        .outerjoin(VerificationCodesModel, VerificationCodesModel.user_id == UserModel.user_id)
+        .where(UserModel.user_verified.is_(False))
+        .order_by(UserModel.user_id)
+        .offset(offset)
+        .limit(limit)
+    )
+    if rows:
+        return rows, rows[0].total
+    # an empty page doesn't tell the total (e.g. when it's beyond the last one)
+    total = await database.fetch_val(
+        select(func.count()).select_from(UserModel).where(UserModel.user_verified.is_(False))
+    )
+    return [], total
+
+
+async def accept_users(user_ids: Iterable[UserID]) -> list[UserID]:
+    """Verifies every given user who is still in the queue (in one transaction); returns their IDs"""
+    async with database.transaction():
+        accepted = [
+            row.user_id
+            for row in await database.fetch_all(
+                UserModel.update()
+                .where(UserModel.user_id.in_(set(user_ids)), UserModel.user_verified.is_(False))
+                .values(user_verified=True)
+                .returning(UserModel.user_id)
+            )
+        ]
+        await add_messages(
+            (user_id, MessageSchema(message="Your account has been accepted.", category=MessageCategory.SUCCESS))
+            for user_id in accepted
+        )
+    return sorted(accepted)
+
+
+async def reject_users(user_ids: Iterable[UserID]) -> list[UserID]:
+    """Deletes every given user who is still in the queue (in one transaction); returns their IDs"""
+    async with database.transaction():
+        rejected = [
+            row.user_id
+            for row in await database.fetch_all(
+                UserModel.delete()
+                .where(UserModel.user_id.in_(set(user_ids)), UserModel.user_verified.is_(False))
+                .returning(UserModel.user_id)
+            )
+        ]
+        if rejected:
+            await database.execute(VerificationCodesModel.delete().where(VerificationCodesModel.user_id.in_(rejected)))
+            await database.execute(MessageModel.delete().where(MessageModel.user_id.in_(rejected)))
+            await database.execute(UnreadCountModel.delete().where(UnreadCountModel.user_id.in_(rejected)))
+    return sorted(rejected)
+
+
+class VerificationCodePurge:
+    """Background task which deletes expired codes together with their (still unverified) registrations
+
+    The messages of the deleted registrations and the pending emails sent to them alone are deleted as well.
+
+    Deletes at most ``BATCH`` codes per transaction and yields to the event loop in between, so the database is
+    never write-locked for long; the index on ``expires_at`` keeps finding them cheap.
+    """
+
+    BATCH = 500
+
+    def __init__(self, interval: float = 3600):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="verification-code-purge")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def purge(self) -> int:
+        """Deletes every expired code; returns the amount of them"""
+        purged = 0
+        while True:
+            async with database.transaction():
+                expired = [
+                    row.user_id
+                    for row in await database.fetch_all(
+                        select(VerificationCodesModel.user_id)
+                        .where(VerificationCodesModel.expires_at <= datetime.utcnow())
+                        .limit(self.BATCH)
+                    )
+                ]
+                if not expired:
+                    return purged
+                await database.execute(
+                    VerificationCodesModel.delete().where(VerificationCodesModel.user_id.in_(expired))
+                )
+                # abandoned registrations, so their email and username can be registered again
+                abandoned = await database.fetch_all(
+                    UserModel.delete()
+                    .where(UserModel.user_id.in_(expired), UserModel.email_verified.is_(False))
+                    .returning(UserModel.user_id, UserModel.email)
+                )
+                if abandoned:
+                    abandoned_ids = [user.user_id for user in abandoned]
+                    await database.execute(MessageModel.delete().where(MessageModel.user_id.in_(abandoned_ids)))
+                    await database.execute(UnreadCountModel.delete().where(UnreadCountModel.user_id.in_(abandoned_ids)))
+                    # emails which are still pending (e.g. their verification email), sent to them alone
+                    await database.execute(
+                        EmailOutboxModel.delete().where(
+                            EmailOutboxModel.recipients.in_([user.email for user in abandoned])
+                        )
+                    )
+            purged += len(expired)
+            await asyncio.sleep(0)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if purged := await self.purge():
+                    sys.stdout.write(f"INFO: purged {purged} expired verification code(s)\n")
+            except Exception:  # noqa
+                sys.stderr.write("ERROR: purging the expired verification codes failed\n")
+                sys.stderr.write(traceback.format_exc())  # will get logged
+            await asyncio.sleep(self.interval)
+
+
+verification_code_purge = VerificationCodePurge(settings.VERIFICATION.PURGE_INTERVAL)
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+# standard library
+import os
+import socket
+import tempfile
+from pathlib import Path
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# the settings are read when ``SSD_Roster.src.environment`` is imported, so they have to be set beforehand
+# (variables of the environment take precedence over ``.env``; the secrets have no default there)
+_directory = Path(tempfile.mkdtemp(prefix="ssd-roster-tests-"))
+for key, value in {
+    "SECRET_KEY": "test",
+    "TOKEN__SECRET_KEY": "test",
+    "DATABASE__URL": f"sqlite:///{_directory / 'sqlite.db'}",
+    "DATABASE__OWNER_EMAIL": "owner@example.com",
+    "MAIL__USERNAME": "test",
+    "MAIL__PASSWORD": "test",
+    "MAIL__FROM": "roster@example.com",
+    "MAIL__SERVER": "127.0.0.1",
+    "MAIL__PORT": str(_free_port()),  # an ``aiosmtpd``-server is started on it by the tests which need one
+    "MAIL__STARTTLS": "false",
+    "MAIL__SSL_TLS": "false",
+    "MAIL__DISABLED": "false",
+    "MAIL__USE_CREDENTIALS": "false",
+    "LOG__ARCHIVE": "",
+}.items():
+    os.environ[key] = value
+
+# templates and static files are looked up relative to the working directory (as when running ``app.py``)
+os.chdir(Path(__file__).parents[1] / "SSD_Roster")
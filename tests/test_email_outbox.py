@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+# standard library
+import asyncio
+import time
+from datetime import datetime
+
+# third party
+import pytest
+from aiosmtpd.controller import Controller
+from fastapi_mail import MessageSchema, MessageType
+
+# typing
+from typing import Awaitable, Callable, Iterator
+
+# local
+from SSD_Roster.src.abc import DBBaseModel
+from SSD_Roster.src.database import database, engine
+from SSD_Roster.src.email import EmailOutbox, smtp_pool
+from SSD_Roster.src.environment import settings
+from SSD_Roster.src.models import EmailOutboxModel
+
+
+class Handler:
+    """Accepts every email, except the next ``rejections`` ones, which get a temporary error"""
+
+    def __init__(self):
+        self.received: list[str] = []  # the subjects
+        self.rejections = 0
+
+    async def handle_DATA(self, server, session, envelope) -> str:  # noqa N802
+        if self.rejections:
+            self.rejections -= 1
+            return "451 Requested action aborted: try again later"
+        self.received.append(envelope.content.decode().split("Subject: ", 1)[1].split("\r\n", 1)[0])
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def smtp_server() -> Iterator[Handler]:
+    handler = Handler()
+    controller = Controller(handler, hostname=settings.MAIL.SERVER, port=settings.MAIL.PORT)
+    controller.start()
+    try:
+        yield handler
+    finally:
+        controller.stop()
+
+
+@pytest.fixture(autouse=True)
+def outbox_table() -> None:
+    DBBaseModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(EmailOutboxModel.delete())
+
+
+async def _wait_for(condition: Callable[[], Awaitable[bool]], timeout: float = 10) -> None:
+    end = time.monotonic() + timeout
+    while not await condition():
+        assert time.monotonic() < end, "timed out"
+        await asyncio.sleep(0.02)
+
+
+async def _run_outbox(outbox: EmailOutbox, subjects: list[str], done: Callable[[], Awaitable[bool]]) -> None:
+    """Queues an email per subject (as the app does, within a transaction) and runs the worker until ``done``"""
+    await database.connect()
+    outbox.start()
+    try:
+        async with database.transaction():
+            for subject in subjects:
+                await outbox.queue(
+                    MessageSchema(
+                        subject=subject, recipients=["user@example.com"], body="<b>Hi</b>", subtype=MessageType.html
+                    )
+                )
+        outbox.notify()
+        await _wait_for(done)
+    finally:
+        await outbox.stop()  # closes the pooled connections as well
+        await database.disconnect()
+
+
+async def _outbox_rows() -> list:
+    return await database.fetch_all(EmailOutboxModel.select().order_by(EmailOutboxModel.outbox_id))
+
+
+def test_delivers_queued_emails(smtp_server: Handler) -> None:
+    async def delivered() -> bool:
+        return not await _outbox_rows()
+
+    asyncio.run(_run_outbox(EmailOutbox(), ["first", "second", "third"], delivered))
+
+    assert sorted(smtp_server.received) == ["first", "second", "third"]
+    assert smtp_pool.connects >= 1
+
+
+def test_retries_with_backoff(smtp_server: Handler) -> None:
+    smtp_server.rejections = 1
+    failed_at: list[datetime] = []
+    retry_at: list[datetime] = []
+
+    async def delivered() -> bool:
+        rows = await _outbox_rows()
+        if rows and rows[0].attempts == 1 and not retry_at:
+            failed_at.append(datetime.utcnow())
+            retry_at.append(rows[0].next_attempt_at)
+            assert "SMTPDataError" in rows[0].last_error
+        return not rows
+
+    asyncio.run(_run_outbox(EmailOutbox(max_attempts=3, backoff=0.5), ["retried"], delivered))
+
+    assert smtp_server.received == ["retried"]
+    # the first retry is delayed by about ``backoff`` (with a jitter of 25%)
+    assert retry_at and 0.25 < (retry_at[0] - failed_at[0]).total_seconds() < 0.65
+
+
+def test_gives_up_after_max_attempts(smtp_server: Handler) -> None:
+    smtp_server.rejections = 100
+
+    async def dead() -> bool:
+        return [row.status for row in await _outbox_rows()] == ["dead"]
+
+    asyncio.run(_run_outbox(EmailOutbox(max_attempts=3, backoff=0.05), ["undeliverable"], dead))
+
+    (row,) = asyncio.run(_rows_without_worker())
+    assert row.attempts == 3
+    assert "451" in row.last_error
+    assert smtp_server.received == []
+    assert smtp_server.rejections == 100 - 3  # dead emails aren't tried anymore
+
+
+async def _rows_without_worker() -> list:
+    await database.connect()
+    try:
+        return await _outbox_rows()
+    finally:
+        await database.disconnect()